@@ -0,0 +1,106 @@
+"""
+    Synthetic, reproducible datasets for the benchmark suite.
+
+    Businesses are clustered around a fixed set of cities with a Gaussian spread,
+    plus a thin uniform background, which is close to how real business listings
+    are distributed and gives the radius search a realistic hit rate.
+"""
+import math
+import random
+
+from django.contrib.auth.hashers import make_password
+
+from businesses.models import Business
+from businesses.sharding import bulk_create_businesses
+from user.models import User
+
+# name, latitude, longitude, relative weight, spread in km
+CITIES = [
+    ('Dhaka', 23.8103, 90.4125, 30, 8),
+    ('Chittagong', 22.3569, 91.7832, 12, 6),
+    ('Khulna', 22.8456, 89.5403, 6, 5),
+    ('Sylhet', 24.8949, 91.8687, 5, 4),
+    ('London', 51.5072, -0.1276, 20, 12),
+    ('New York', 40.7128, -74.0060, 25, 10),
+    ('Berlin', 52.5200, 13.4050, 10, 8),
+    ('Tokyo', 35.6762, 139.6503, 22, 15),
+]
+BACKGROUND_RATIO = 0.05
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+
+def parse_size(value):
+    """
+        Parses a dataset size such as '1k', '100k', '1m' or a plain integer.
+    """
+    value = value.lower()
+    if value in SIZES:
+        return SIZES[value]
+    return int(value)
+
+
+def city_center(name):
+    for city, lat, lon, weight, spread in CITIES:
+        if city.lower() == name.lower():
+            return lat, lon
+    return None
+
+
+def generate_businesses(count, seed=0):
+    """
+        Yields unsaved Business objects with clustered coordinates.
+
+        Args:
+            count (int): Number of businesses to generate.
+            seed (int): Seed making the dataset reproducible.
+    """
+    rng = random.Random(seed)
+    weights = [city[3] for city in CITIES]
+    for i in range(count):
+        if rng.random() < BACKGROUND_RATIO:
+            lat, lon, location = rng.uniform(-60, 70), rng.uniform(-180, 180), 'Rural'
+        else:
+            location, center_lat, center_lon, weight, spread = rng.choices(CITIES, weights)[0]
+            # Kilometres to degrees, widening longitude away from the equator.
+            lat = center_lat + rng.gauss(0, spread) / 111.0
+            lon = center_lon + rng.gauss(0, spread) / (111.0 * math.cos(math.radians(center_lat)))
+        yield Business(
+            name='Business %d' % i,
+            location=location,
+            latitude=round(lat, 6),
+            longitude=round(max(-180.0, min(180.0, lon)), 6),
+        )
+
+
+def load_businesses(count, seed=0, batch_size=5000):
+    """
+        Inserts `count` generated businesses into the database.
+    """
+    batch = []
+    for business in generate_businesses(count, seed):
+        batch.append(business)
+        if len(batch) >= batch_size:
+            bulk_create_businesses(batch)
+            batch = []
+    if batch:
+        bulk_create_businesses(batch)
+
+
+def load_users(count, batch_size=5000):
+    """
+        Inserts `count` active users sharing BENCHMARK_PASSWORD.
+
+        The password is hashed once so loading stays fast at any size.
+
+        Returns:
+            list: The email addresses of the created users.
+    """
+    password = make_password(BENCHMARK_PASSWORD)
+    emails = ['user%d@benchmark.test' % i for i in range(count)]
+    for start in range(0, count, batch_size):
+        User.objects.bulk_create(
+            [User(email=email, password=password, fullname=email) for email in emails[start:start + batch_size]]
+        )
+    return emails
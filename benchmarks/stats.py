@@ -0,0 +1,26 @@
+import math
+
+
+def percentile(sorted_samples, fraction):
+    # Nearest-rank percentile.
+    rank = max(1, math.ceil(fraction * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+
+def summarize(samples):
+    """
+        Summarizes latency samples given in seconds.
+
+        Returns:
+            dict: Sample count, ops/sec and p50/p95/p99 latency in milliseconds.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {'samples': 0, 'ops_per_sec': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+    return {
+        'samples': len(samples),
+        'ops_per_sec': len(samples) / sum(samples),
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+    }
@@ -0,0 +1,29 @@
+"""
+    Test doubles shared by the benchmark suite and the loadtest command.
+"""
+from unittest import mock
+
+from benchmarks.dataset import city_center
+
+
+class StubGeocoder:
+    """
+        Drop-in replacement for geopy's Bing geocoder resolving the benchmark
+        city names locally, so no benchmark depends on network latency.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def geocode(self, query, *args, **kwargs):
+        center = city_center(query)
+        if center is None:
+            return None
+        return mock.Mock(latitude=center[0], longitude=center[1])
+
+
+def patch_geocoder():
+    """
+        Returns a patcher replacing the Bing geocoder with StubGeocoder.
+    """
+    return mock.patch('businesses.location_helpers.get_geocoder', StubGeocoder)
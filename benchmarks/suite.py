@@ -0,0 +1,179 @@
+"""
+    Performance benchmark suite for the business and auth APIs.
+
+    Loads a synthetic dataset into throwaway test databases, runs every
+    benchmark at each requested size and reports ops/sec with p50/p95/p99
+    latencies. Results can be saved as a baseline and later runs compared
+    against it; the run exits with status 1 if any benchmark regressed.
+
+    Usage:
+        python -m benchmarks.suite --sizes 1k,100k --save-baseline benchmarks/baseline.json
+        python -m benchmarks.suite --sizes 1k,100k --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from operator import attrgetter
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mbapp.settings')
+django.setup()
+
+from django.core.handlers.base import BaseHandler  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+from benchmarks.dataset import (  # noqa: E402
+    BENCHMARK_PASSWORD, city_center, load_businesses, load_users, parse_size,
+)
+from benchmarks.stats import summarize  # noqa: E402
+from benchmarks.stubs import patch_geocoder  # noqa: E402
+from businesses.location_helpers import filter_by_distance  # noqa: E402
+from businesses.models import Business  # noqa: E402
+from businesses.serializers import BusinessSerializer  # noqa: E402
+from businesses.sharding import all_shards, query_shards  # noqa: E402
+from businesses.views import BusinessList  # noqa: E402
+from user.models import User  # noqa: E402
+from user.utils import get_tokens_for_user  # noqa: E402
+from user.views import SignInView  # noqa: E402
+
+SEARCH_CITY = 'Dhaka'
+SERIALIZER_BATCH = 100
+USER_COUNT = 1000
+MIN_SAMPLES = 3
+
+
+def measure(func, iterations, max_time):
+    """
+        Times repeated calls of `func` after one warm-up call.
+
+        Stops after `iterations` samples, or earlier once `max_time` seconds have
+        passed and at least MIN_SAMPLES samples were taken.
+
+        Returns:
+            dict: Sample count, ops/sec and p50/p95/p99 latency in milliseconds.
+    """
+    func()
+    samples = []
+    deadline = time.perf_counter() + max_time
+    while len(samples) < iterations and (len(samples) < MIN_SAMPLES or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def build_benchmarks():
+    """
+        Returns the benchmarks as (name, callable) pairs for the loaded dataset.
+    """
+    lat, lon = city_center(SEARCH_CITY)
+    user = User.objects.order_by('pk').first()
+    first = Business.objects.order_by('pk')[:SERIALIZER_BATCH]
+    businesses = sorted(query_shards(first, all_shards()), key=attrgetter('pk'))[:SERIALIZER_BATCH]
+    api_factory = APIRequestFactory()
+    business_list = BusinessList.as_view()
+    sign_in = SignInView.as_view()
+
+    def business_list_get():
+        request = api_factory.get('/businesses/', {'location': SEARCH_CITY})
+        force_authenticate(request, user=user)
+        business_list(request)
+
+    def sign_in_post():
+        request = api_factory.post('/user/api/signin/', {'email': user.email, 'password': BENCHMARK_PASSWORD},
+                                   format='json')
+        sign_in(request)
+
+    handler = BaseHandler()
+    handler.load_middleware()
+    request_factory = RequestFactory()
+    authorization = 'Bearer ' + get_tokens_for_user(user)['access']
+
+    def jwt_request():
+        handler.get_response(request_factory.get('/user/api/details/', HTTP_AUTHORIZATION=authorization))
+
+    return [
+        ('filter_by_distance', lambda: filter_by_distance(lat, lon)),
+        ('business_list_get', business_list_get),
+        ('business_serializer', lambda: BusinessSerializer(businesses, many=True).data),
+        ('sign_in', sign_in_post),
+        ('jwt_request', jwt_request),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """
+        Lists benchmarks whose p50 grew by more than `tolerance` over the baseline.
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous and result['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+                regressions.append((size, name, previous['p50_ms'], result['p50_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1k', help="Comma separated dataset sizes, e.g. 1k,100k,1m.")
+    parser.add_argument('--iterations', type=int, default=50, help="Maximum samples per benchmark.")
+    parser.add_argument('--max-time', type=float, default=10.0, help="Time budget in seconds per benchmark.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--baseline', help="Baseline JSON to compare against.")
+    parser.add_argument('--save-baseline', help="Write the results as the new baseline to this file.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p50 slowdown before failing.")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    # Every database gets a test copy, shards included, and replicas mirror the primary's.
+    old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=())
+    results = {}
+    try:
+        load_users(USER_COUNT)
+        with patch_geocoder():
+            for size in args.sizes.split(','):
+                count = parse_size(size)
+                Business.objects.all().delete()
+                started = time.perf_counter()
+                load_businesses(count, seed=args.seed)
+                print('Loaded %d businesses in %.1fs' % (count, time.perf_counter() - started))
+
+                results[size] = {}
+                print('%-22s %8s %12s %10s %10s %10s' % ('benchmark', 'samples', 'ops/sec', 'p50 ms', 'p95 ms', 'p99 ms'))
+                for name, func in build_benchmarks():
+                    result = results[size][name] = measure(func, args.iterations, args.max_time)
+                    print('%-22s %8d %12.1f %10.2f %10.2f %10.2f' % (
+                        name, result['samples'], result['ops_per_sec'],
+                        result['p50_ms'], result['p95_ms'], result['p99_ms']))
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for size, name, before, after in regressions:
+            print('REGRESSION %s/%s: p50 %.2fms -> %.2fms' % (size, name, before, after))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against %s.' % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class BusinessesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "businesses"
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save, pre_save
+
+        from businesses.models import Business
+        from businesses.sharding import allocate_business_id, release_business_id, remove_moved_business
+        pre_save.connect(allocate_business_id, sender=Business)
+        post_save.connect(remove_moved_business, sender=Business)
+        post_delete.connect(release_business_id, sender=Business)
@@ -1,12 +1,33 @@
-from geopy import distance
-from geopy.geocoders import Bing
-from rest_framework import status
-from rest_framework.response import Response
+import math
+import time
+from functools import lru_cache
 
-from mbapp.settings import BING_MAPS_API_KEY
+from django.conf import settings
+
+from mbapp.metrics import BUSINESS_ROWS_SCANNED, GEOCODER_LATENCY, GEOCODER_REQUESTS
+from mbapp.tracing import span, traced
 from .models import Business
+from .sharding import query_shards, shards_for_box
+
+SEARCH_RADIUS_KM = 10
+# Kilometres per degree of latitude at the equator, where a degree is shortest.
+KM_PER_DEGREE = 110.574
+
+
+@lru_cache(maxsize=None)
+def get_geocoder():
+    """
+        Returns the shared Bing geocoder, importing geopy on first use.
+
+        geopy and its HTTP stack are only loaded by processes that actually
+        geocode, which keeps them out of the application's cold start.
+    """
+    from geopy.geocoders import Bing
+
+    return Bing(api_key=settings.BING_MAPS_API_KEY)
 
 
+@traced('geocode')
 def geocode_location(location):
     """
         Geocodes a given location using the Bing Maps API.
@@ -18,35 +39,118 @@ def geocode_location(location):
             tuple: A tuple containing the latitude and longitude of the geocoded location,
                    or (None, None) if the location could not be geocoded.
     """
-    geolocator = Bing(api_key=BING_MAPS_API_KEY)
-    location = geolocator.geocode(location)
+    geolocator = get_geocoder()
+    started = time.perf_counter()
+    try:
+        location = geolocator.geocode(location)
+    except Exception:
+        GEOCODER_REQUESTS.inc(labels=('error',))
+        raise
+    finally:
+        GEOCODER_LATENCY.observe(time.perf_counter() - started)
     if location is not None:
+        GEOCODER_REQUESTS.inc(labels=('found',))
         return location.latitude, location.longitude
     else:
+        GEOCODER_REQUESTS.inc(labels=('not_found',))
         return None, None
 
 
-def filter_by_distance(lat, lon):
+def bounding_box(lat, lon, radius_km):
     """
-        Filters businesses by distance from a given location.
+        Computes a latitude/longitude box containing every point within radius_km.
 
         Args:
+            lat (float): The latitude of the center.
+            lon (float): The longitude of the center.
+            radius_km (float): The radius around the center.
+
+        Returns:
+            tuple: (min_lat, max_lat, min_lon, max_lon). The longitude bounds are None
+            when the box reaches a pole or crosses the antimeridian.
+    """
+    lat, lon = float(lat), float(lon)
+    # Pad by 1% to stay on the safe side of the ellipsoid approximation.
+    lat_delta = radius_km / KM_PER_DEGREE * 1.01
+    min_lat, max_lat = lat - lat_delta, lat + lat_delta
+    if min_lat <= -90 or max_lat >= 90:
+        return min_lat, max_lat, None, None
+    lon_delta = lat_delta / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    min_lon, max_lon = lon - lon_delta, lon + lon_delta
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def iter_within_radius(businesses, lat, lon, radius_km=SEARCH_RADIUS_KM):
+    """
+        Lazily yields the businesses whose geodesic distance from a location is within radius_km.
+
+        Args:
+            businesses (iterable): Candidate businesses, usually from a bounding box query.
             lat (float): The latitude of the location.
             lon (float): The longitude of the location.
+            radius_km (float): The radius around the location.
 
         Returns:
-            list: A list of businesses within 10km of the given location,
-            or a Response with status 404 if no businesses are found.
+            generator: The businesses within the radius, in their original order.
     """
+    from geopy import distance
+
     location = (lat, lon)
-    businesses = Business.objects.all()
-    nearby_businesses = []
     for business in businesses:
-        if business.latitude is not None and business.longitude is not None:
-            business_location = (business.latitude, business.longitude)
-            print(business_location)
-            if distance.distance(location, business_location).km <= 10:
-                nearby_businesses.append(business)
-        else:
-            return Response({'detail': 'No data found.'}, status=status.HTTP_404_NOT_FOUND)
-    return nearby_businesses
+        if business.latitude is None or business.longitude is None:
+            continue
+        business_location = (business.latitude, business.longitude)
+        if distance.distance(location, business_location).km <= radius_km:
+            yield business
+
+
+def within_radius(businesses, lat, lon, radius_km=SEARCH_RADIUS_KM):
+    """
+        Keeps the businesses whose geodesic distance from a location is within radius_km.
+
+        Returns:
+            list: The businesses within the radius, in their original order.
+    """
+    with span('distance'):
+        return list(iter_within_radius(businesses, lat, lon, radius_km))
+
+
+def in_bounding_box(lat, lon, radius_km=SEARCH_RADIUS_KM):
+    """
+        Returns a queryset of the businesses inside the bounding box of radius_km around a location.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    queryset = Business.objects.filter(latitude__range=(min_lat, max_lat))
+    if min_lon is not None:
+        queryset = queryset.filter(longitude__range=(min_lon, max_lon))
+    return queryset
+
+
+def nearby_shards(lat, lon, radius_km=SEARCH_RADIUS_KM):
+    """
+        Returns the shards holding businesses within radius_km of a location, see businesses.sharding.
+    """
+    return shards_for_box(bounding_box(lat, lon, radius_km))
+
+
+def filter_by_distance(lat, lon):
+    """
+        Filters businesses by distance from a given location.
+
+        Only businesses inside the bounding box of the search radius are read
+        from the database, querying the shards it overlaps in parallel; the
+        exact geodesic distance is checked for those.
+
+        Args:
+            lat (float): The latitude of the location.
+            lon (float): The longitude of the location.
+
+        Returns:
+            list: A list of businesses within 10km of the given location.
+    """
+    with span('db'):
+        businesses = query_shards(in_bounding_box(lat, lon), nearby_shards(lat, lon))
+    BUSINESS_ROWS_SCANNED.inc(len(businesses))
+    return within_radius(businesses, lat, lon)
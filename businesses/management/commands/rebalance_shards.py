@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from businesses.sharding import backfill_shards, move_cell, plan_rebalance, shard_loads, sharding_enabled
+
+
+class Command(BaseCommand):
+    help = (
+        "Show how businesses are spread over the shards and move cells between them, "
+        "either explicitly with --move or as planned by --balance. --backfill moves "
+        "businesses stored in the default database before sharding was enabled to their shards."
+    )
+
+    def add_arguments(self, parser):
+        actions = parser.add_mutually_exclusive_group()
+        actions.add_argument('--move', nargs=2, action='append', default=[], metavar=('CELL', 'SHARD'),
+                            help="Move a cell, e.g. 23:90, to a shard alias. Can be repeated.")
+        actions.add_argument('--balance', action='store_true',
+                            help="Move cells from the fullest to the emptiest shards until they are even.")
+        actions.add_argument('--backfill', action='store_true',
+                             help="Move the businesses of the default database's table to their shards.")
+        parser.add_argument('--tolerance', type=float, default=0.05,
+                            help="Imbalance left by --balance, as a fraction of the average shard load.")
+        parser.add_argument('--dry-run', action='store_true', help="Only print the moves.")
+        parser.add_argument('--wait', type=float, default=settings.BUSINESS_SHARD_MAP_TTL,
+                            help="Seconds to wait after reassigning a cell, before deleting its old rows, "
+                                 "for every process to reload its shard map.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows copied and deleted per query.")
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError('No shards configured, set DB_SHARDS.')
+        if options['backfill']:
+            if options['dry_run']:
+                raise CommandError('--backfill cannot be combined with --dry-run.')
+            try:
+                moved = backfill_shards(batch_size=options['batch_size'])
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(self.style.SUCCESS('Moved %d businesses from the default database to the shards.' % moved))
+        loads = shard_loads()
+        self._write_loads(loads)
+
+        if options['balance']:
+            moves = plan_rebalance(loads, options['tolerance'])
+        else:
+            moves = []
+            for cell, target in options['move']:
+                source = next((shard for shard, cells in loads.items() if cell in cells), None)
+                moves.append((cell, source, target, loads.get(source, {}).get(cell, 0)))
+        for cell, source, target, businesses in moves:
+            if options['dry_run']:
+                self.stdout.write('Would move cell %s from %s to %s (%d businesses).' % (cell, source, target, businesses))
+                continue
+            try:
+                moved = move_cell(cell, target, wait=options['wait'], batch_size=options['batch_size'])
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(self.style.SUCCESS('Moved cell %s to %s (%d businesses).' % (cell, target, moved)))
+        if moves and not options['dry_run']:
+            self._write_loads(shard_loads())
+
+    def _write_loads(self, loads):
+        for shard, cells in loads.items():
+            largest = sorted(cells.items(), key=lambda item: item[1], reverse=True)[:5]
+            self.stdout.write('%-12s %8d businesses %6d cells   largest: %s' % (
+                shard, sum(cells.values()), len(cells),
+                ', '.join('%s (%d)' % cell for cell in largest) or '-'))
@@ -0,0 +1,71 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE businesses_business_fts USING fts5(
+        name, location,
+        content='businesses_business', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER businesses_business_fts_insert AFTER INSERT ON businesses_business BEGIN
+        INSERT INTO businesses_business_fts(rowid, name, location) VALUES (new.id, new.name, new.location);
+    END
+    """,
+    """
+    CREATE TRIGGER businesses_business_fts_delete AFTER DELETE ON businesses_business BEGIN
+        INSERT INTO businesses_business_fts(businesses_business_fts, rowid, name, location)
+        VALUES ('delete', old.id, old.name, old.location);
+    END
+    """,
+    """
+    CREATE TRIGGER businesses_business_fts_update AFTER UPDATE OF name, location ON businesses_business BEGIN
+        INSERT INTO businesses_business_fts(businesses_business_fts, rowid, name, location)
+        VALUES ('delete', old.id, old.name, old.location);
+        INSERT INTO businesses_business_fts(rowid, name, location) VALUES (new.id, new.name, new.location);
+    END
+    """,
+    "INSERT INTO businesses_business_fts(businesses_business_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS businesses_business_fts_update",
+    "DROP TRIGGER IF EXISTS businesses_business_fts_delete",
+    "DROP TRIGGER IF EXISTS businesses_business_fts_insert",
+    "DROP TABLE IF EXISTS businesses_business_fts",
+]
+
+# Must stay identical to businesses.search.POSTGRES_SEARCH_VECTOR for the index to be used.
+POSTGRES_FORWARD = [
+    """
+    CREATE INDEX businesses_business_search_idx ON businesses_business USING GIN ((
+        setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', location), 'B')
+    ))
+    """,
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS businesses_business_search_idx",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("businesses", "0002_business_latitude_business_longitude_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            run_for_vendor({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+            # Lets database routers apply it wherever the business table lives, shards included.
+            hints={"model_name": "business"},
+        ),
+    ]
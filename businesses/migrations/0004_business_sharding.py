@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-19 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("businesses", "0003_business_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BusinessLocator",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("cell", models.CharField(db_index=True, max_length=32)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ShardCell",
+            fields=[
+                (
+                    "cell",
+                    models.CharField(max_length=32, primary_key=True, serialize=False),
+                ),
+                ("shard", models.CharField(max_length=64)),
+            ],
+        ),
+    ]
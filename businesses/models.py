@@ -1,4 +1,65 @@
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured
+from django.db import NotSupportedError, models
+
+from mbapp.db import shard_aliases
+
+
+class BusinessQuerySet(models.QuerySet):
+    """
+        With sharding, queries have to name their shard with using(). The
+        exceptions are update(), delete() and count(), whose results add up
+        across shards: without using() they run on every shard.
+    """
+
+    def create(self, **kwargs):
+        """
+            Like QuerySet.create, but unless using() was called the routers pick the
+            database with the new business as hint, which puts it on its cell's shard.
+        """
+        business = self.model(**kwargs)
+        self._for_write = True
+        business.save(force_insert=True, using=self._db)
+        return business
+
+    def _unrouted_shards(self):
+        # The shards a query runs on when it does not name one, none without sharding.
+        return shard_aliases() if self._db is None else []
+
+    def _fan_out(self, method, *args, **kwargs):
+        from .sharding import fan_out
+        return fan_out(lambda alias: getattr(self.using(alias), method)(*args, **kwargs), self._unrouted_shards())
+
+    def _on_every_shard(self, method, *args, **kwargs):
+        # Writes run one shard at a time: their signal receivers all write to the primary's directory.
+        return [getattr(self.using(alias), method)(*args, **kwargs) for alias in self._unrouted_shards()]
+
+    def update(self, **kwargs):
+        if shard_aliases() and {'latitude', 'longitude'} & set(kwargs):
+            # The business would stay on the shard of its old cell.
+            raise NotSupportedError('Coordinates of sharded businesses can only be changed with save().')
+        if self._unrouted_shards():
+            return sum(self._on_every_shard('update', **kwargs))
+        return super().update(**kwargs)
+    update.alters_data = True
+
+    def delete(self):
+        if self._unrouted_shards():
+            deleted, per_model = 0, {}
+            for shard_deleted, shard_per_model in self._on_every_shard('delete'):
+                deleted += shard_deleted
+                for label, count in shard_per_model.items():
+                    per_model[label] = per_model.get(label, 0) + count
+            return deleted, per_model
+        return super().delete()
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def count(self):
+        if self._unrouted_shards():
+            if self.query.is_sliced:
+                raise ImproperlyConfigured('Sliced business queries have to name their shard with using().')
+            return sum(self._fan_out('count'))
+        return super().count()
 
 
 class Business(models.Model):
@@ -7,8 +68,36 @@ class Business(models.Model):
     latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
 
+    objects = BusinessQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            from .sharding import restore_business_id
+            restore_business_id(self)
+            raise
+
     class Meta:
         verbose_name_plural = "Businesses"
+
+
+class ShardCell(models.Model):
+    """
+        Assigns a spatial cell to the database shard holding its businesses, see businesses.sharding.
+    """
+    cell = models.CharField(max_length=32, primary_key=True)
+    shard = models.CharField(max_length=64)
+
+    def __str__(self):
+        return '%s -> %s' % (self.cell, self.shard)
+
+
+class BusinessLocator(models.Model):
+    """
+        Allocates business ids across shards and records the cell each business is stored under.
+    """
+    cell = models.CharField(max_length=32, db_index=True)
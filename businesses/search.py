@@ -0,0 +1,126 @@
+import re
+from operator import attrgetter
+
+from django.db import connections
+from django.db.models import Q
+
+from mbapp.tracing import span
+from .location_helpers import SEARCH_RADIUS_KM, bounding_box, within_radius
+from .models import Business
+from .sharding import all_shards, fan_out, shards_for_box
+
+SEARCH_RESULT_LIMIT = 50
+# Name matches outrank location matches.
+NAME_WEIGHT = 10.0
+LOCATION_WEIGHT = 1.0
+
+POSTGRES_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', location), 'B')"
+)
+
+SQLITE_SEARCH_SQL = """
+    SELECT businesses_business.*, bm25(businesses_business_fts, %s, %s) AS search_rank
+    FROM businesses_business_fts
+    JOIN businesses_business ON businesses_business.id = businesses_business_fts.rowid
+    WHERE businesses_business_fts MATCH %s{bbox}
+    ORDER BY search_rank
+    LIMIT %s
+"""
+POSTGRES_SEARCH_SQL = """
+    SELECT businesses_business.*, -ts_rank({vector}, query) AS search_rank
+    FROM businesses_business, to_tsquery('simple', %s) AS query
+    WHERE ({vector}) @@ query{bbox}
+    ORDER BY search_rank
+    LIMIT %s
+"""
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(text):
+    """
+        Splits free text into the words to search for, dropping any query syntax.
+    """
+    return TOKEN_RE.findall(text.lower())
+
+
+def _bbox_sql(box):
+    if box is None:
+        return '', []
+    min_lat, max_lat, min_lon, max_lon = box
+    sql = ' AND businesses_business.latitude BETWEEN %s AND %s'
+    params = [min_lat, max_lat]
+    if min_lon is not None:
+        sql += ' AND businesses_business.longitude BETWEEN %s AND %s'
+        params += [min_lon, max_lon]
+    return sql, params
+
+
+def _search_shard(alias, terms, box, limit):
+    manager = Business.objects.db_manager(alias)
+    vendor = connections[manager.db].vendor
+    bbox_sql, bbox_params = _bbox_sql(box)
+    if vendor == 'sqlite':
+        match = ' '.join('"%s"' % term for term in terms[:-1]) + ' "%s"*' % terms[-1]
+        return list(manager.raw(
+            SQLITE_SEARCH_SQL.format(bbox=bbox_sql),
+            [NAME_WEIGHT, LOCATION_WEIGHT, match.strip()] + bbox_params + [limit],
+        ))
+    if vendor == 'postgresql':
+        query = ' & '.join(terms[:-1] + ['%s:*' % terms[-1]])
+        return list(manager.raw(
+            POSTGRES_SEARCH_SQL.format(vector=POSTGRES_SEARCH_VECTOR, bbox=bbox_sql),
+            [query] + bbox_params + [limit],
+        ))
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(location__icontains=term)
+    queryset = manager.filter(condition)
+    if box is not None:
+        queryset = queryset.filter(latitude__range=box[:2])
+        if box[2] is not None:
+            queryset = queryset.filter(longitude__range=box[2:])
+    businesses = list(queryset[:limit])
+    for business in businesses:
+        business.search_rank = 0
+    return businesses
+
+
+def search_businesses(text, near=None, limit=SEARCH_RESULT_LIMIT):
+    """
+        Finds businesses whose name or location match every word of a query.
+
+        The last word matches as a prefix, so partial input such as "coff" finds
+        "Coffee House". Matching is served by the full-text index created in
+        migration 0003: an FTS5 table on SQLite, a GIN tsvector index on
+        PostgreSQL. Other databases fall back to an unindexed icontains filter.
+        With sharding, the shards concerned are searched in parallel and their
+        best matches merged.
+
+        Args:
+            text (str): The search query.
+            near (tuple): Optional (latitude, longitude); restricts the results
+                to businesses within the search radius of it.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list: Matching businesses, best match first.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+    box = bounding_box(near[0], near[1], SEARCH_RADIUS_KM) if near is not None else None
+    aliases = shards_for_box(box) if box is not None else all_shards()
+
+    with span('search'):
+        results = fan_out(lambda alias: _search_shard(alias, terms, box, limit), aliases)
+    if len(results) == 1:
+        businesses = results[0]
+    else:
+        # Ranks are lower for better matches on every backend.
+        businesses = sorted((business for shard in results for business in shard), key=attrgetter('search_rank'))
+        businesses = businesses[:limit]
+
+    if near is not None:
+        businesses = within_radius(businesses, near[0], near[1])
+    return businesses
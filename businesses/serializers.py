@@ -6,3 +6,14 @@ class BusinessSerializer(serializers.ModelSerializer):
     class Meta:
         model = Business
         fields = ['id', 'name', 'location', 'latitude', 'longitude']
+
+
+def business_rows(businesses):
+    """
+        Converts businesses to plain dicts with the fields of BusinessSerializer, one at a time.
+
+        Used where results are streamed and running the serializer for every row would dominate.
+    """
+    fields = BusinessSerializer.Meta.fields
+    for business in businesses:
+        yield {field: getattr(business, field) for field in fields}
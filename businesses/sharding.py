@@ -0,0 +1,502 @@
+"""
+Region sharding of the business table.
+
+The world is divided into square cells of BUSINESS_SHARD_CELL_DEGREES, and
+every cell is stored on one of the shard_<n> databases configured with
+DB_SHARDS. The primary database keeps the directory:
+
+    ShardCell        cell -> shard assignments, changed by rebalancing
+    BusinessLocator  one row per business, allocating its id and recording its cell
+
+A cell without an assignment belongs to the shard its hash picks; it is
+recorded on the first write so adding shards later does not move it.
+Without DB_SHARDS configured the functions here fall back to the single
+business table and the router stays out of the way.
+"""
+import heapq
+import itertools
+import math
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.color import no_style
+from django.db import close_old_connections, connections
+from django.db.models import Count
+
+from mbapp.db import PRIMARY_DB, SHARD_PREFIX, bind_context, shard_aliases
+from .models import Business, BusinessLocator, ShardCell
+
+NO_CELL = 'none'
+UNROUTED_QUERY = (
+    'Business queries have to name their shard with using() when DB_SHARDS is set, see businesses.sharding.'
+)
+
+_moving_rows = ContextVar('businesses_moving_rows', default=False)
+_executor = None
+
+
+def sharding_enabled():
+    return bool(shard_aliases())
+
+
+def cell_for(lat, lon):
+    """
+        Returns the cell containing a coordinate, NO_CELL for businesses without one.
+    """
+    if lat is None or lon is None:
+        return NO_CELL
+    size = settings.BUSINESS_SHARD_CELL_DEGREES
+    return '%d:%d' % (math.floor(float(lat) / size), math.floor(float(lon) / size))
+
+
+def cells_in_box(min_lat, max_lat, min_lon, max_lon):
+    """
+        Lists the cells intersecting a latitude/longitude box.
+
+        Longitude bounds of None, as returned by bounding_box() near the poles
+        and the antimeridian, stand for every longitude.
+    """
+    size = settings.BUSINESS_SHARD_CELL_DEGREES
+    if min_lon is None:
+        min_lon, max_lon = -180.0, 180.0
+    lat_cells = range(math.floor(max(min_lat, -90.0) / size), math.floor(min(max_lat, 90.0) / size) + 1)
+    lon_cells = range(math.floor(min_lon / size), math.floor(max_lon / size) + 1)
+    return ['%d:%d' % cell for cell in itertools.product(lat_cells, lon_cells)]
+
+
+class ShardMap:
+    """
+        The ShardCell assignments, cached per process for BUSINESS_SHARD_MAP_TTL seconds.
+    """
+
+    def __init__(self):
+        self._cells = None
+        self._loaded = 0.0
+
+    def cells(self):
+        if self._cells is None or time.monotonic() - self._loaded > settings.BUSINESS_SHARD_MAP_TTL:
+            self.reload()
+        return self._cells
+
+    def reload(self):
+        self._cells = dict(ShardCell.objects.using(PRIMARY_DB).values_list('cell', 'shard'))
+        self._loaded = time.monotonic()
+
+    def clear(self):
+        self._cells = None
+
+    def shard_for_cell(self, cell):
+        shard = self.cells().get(cell)
+        if shard is None:
+            shards = shard_aliases()
+            shard = shards[zlib.crc32(cell.encode()) % len(shards)]
+        return shard
+
+    def assign(self, cell, shard):
+        """
+            Records the shard of a cell on its first write.
+        """
+        cells = self.cells()
+        if cell not in cells:
+            assignment, _ = ShardCell.objects.using(PRIMARY_DB).get_or_create(cell=cell, defaults={'shard': shard})
+            cells[cell] = assignment.shard
+        return cells[cell]
+
+
+shard_map = ShardMap()
+
+
+def shards_for_box(box):
+    """
+        Returns the shards holding the businesses inside a bounding_box() result.
+
+        Returns:
+            list: Shard aliases, or [None] when sharding is disabled. Passed to
+            QuerySet.using(), None leaves the choice of database to the routers.
+    """
+    if not sharding_enabled():
+        return [None]
+    return sorted({shard_map.shard_for_cell(cell) for cell in cells_in_box(*box)})
+
+
+def all_shards():
+    return shard_aliases() or [None]
+
+
+def shard_for_business(pk):
+    """
+        Returns the shard holding business pk, None when sharding is disabled.
+
+        Raises:
+            Business.DoesNotExist: If no business has this id.
+    """
+    if not sharding_enabled():
+        return None
+    try:
+        cell = BusinessLocator.objects.using(PRIMARY_DB).values_list('cell', flat=True).get(pk=pk)
+    except BusinessLocator.DoesNotExist:
+        raise Business.DoesNotExist('No business with id %s.' % pk)
+    return shard_map.shard_for_cell(cell)
+
+
+def get_business(pk):
+    return Business.objects.using(shard_for_business(pk)).get(pk=pk)
+
+
+def _run_on_shard(func, alias):
+    # Pool threads never see the request signals that expire old connections.
+    close_old_connections()
+    return func(alias)
+
+
+def fan_out(func, aliases):
+    """
+        Calls func(alias) for every shard alias and returns the results in order.
+
+        Several shards are queried in parallel, each from a pool thread with its
+        own connection, in a copy of the caller's context so query counters see
+        their queries. The calls run in the calling thread instead when there is
+        a single shard, or when the caller has a transaction open on one of them,
+        since its uncommitted writes are only visible on its own connection.
+    """
+    global _executor
+    if len(aliases) < 2 or any(alias and connections[alias].in_atomic_block for alias in aliases):
+        return [func(alias) for alias in aliases]
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.BUSINESS_SHARD_WORKERS, thread_name_prefix='shard-query')
+    futures = [_executor.submit(bind_context(_run_on_shard), func, alias) for alias in aliases]
+    return [future.result() for future in futures]
+
+
+def query_shards(queryset, aliases):
+    """
+        Evaluates a queryset on several shards in parallel and concatenates the results.
+    """
+    return list(itertools.chain.from_iterable(fan_out(lambda alias: list(queryset.using(alias)), aliases)))
+
+
+def iterate_shards(queryset, aliases, chunk_size, key=None):
+    """
+        Streams a queryset from several shards, reading each through a server-side cursor.
+
+        Args:
+            queryset (QuerySet): The query to run on every shard.
+            aliases (list): The shards to read.
+            chunk_size (int): Rows fetched from a cursor at a time.
+            key (callable): Optional sort key; the shards' results, each ordered
+                by it, are then merged into one ordered stream.
+    """
+    iterators = [queryset.using(alias).iterator(chunk_size=chunk_size) for alias in aliases]
+    if key is None:
+        return itertools.chain.from_iterable(iterators)
+    return heapq.merge(*iterators, key=key)
+
+
+def bulk_create_businesses(businesses, batch_size=None):
+    """
+        Inserts businesses like QuerySet.bulk_create, on the shards of their cells.
+    """
+    if not sharding_enabled():
+        return Business.objects.bulk_create(businesses, batch_size=batch_size)
+    cells = [cell_for(business.latitude, business.longitude) for business in businesses]
+    locators = BusinessLocator.objects.using(PRIMARY_DB).bulk_create(
+        [BusinessLocator(pk=business.pk, cell=cell) for business, cell in zip(businesses, cells)],
+        batch_size=batch_size,
+    )
+    by_shard = defaultdict(list)
+    for business, locator, cell in zip(businesses, locators, cells):
+        business.pk = locator.pk
+        by_shard[shard_map.assign(cell, shard_map.shard_for_cell(cell))].append(business)
+    pending = list(by_shard.items())
+    try:
+        while pending:
+            shard, group = pending[0]
+            Business.objects.using(shard).bulk_create(group, batch_size=batch_size)
+            pending.pop(0)
+    except Exception:
+        # The ids of businesses no shard received are released again.
+        BusinessLocator.objects.using(PRIMARY_DB).filter(
+            pk__in=[business.pk for _, group in pending for business in group]).delete()
+        raise
+    return businesses
+
+
+@contextmanager
+def moving_rows():
+    """
+        Marks deletes that remove a business from a shard it has been copied away from.
+    """
+    token = _moving_rows.set(True)
+    try:
+        yield
+    finally:
+        _moving_rows.reset(token)
+
+
+def allocate_business_id(sender, instance, raw, using, **kwargs):
+    """
+        pre_save receiver giving businesses saved to a shard an id from the primary's BusinessLocator.
+
+        The locator is written before the business, on another database, so
+        Business.save() calls restore_business_id() when the business could
+        not be saved.
+    """
+    if not using.startswith(SHARD_PREFIX):
+        return
+    cell = cell_for(instance.latitude, instance.longitude)
+    shard_map.assign(cell, using)
+    locators = BusinessLocator.objects.using(PRIMARY_DB)
+    if instance.pk is None:
+        instance.pk = locators.create(cell=cell).pk
+        # (id, cell to restore or None to release the id, whether the id was generated)
+        instance._allocated_locator = (instance.pk, None, True)
+        return
+    moving = instance._state.db is not None and instance._state.db != using
+    previous_cell = locators.filter(pk=instance.pk).values_list('cell', flat=True).first() if moving else None
+    if not locators.filter(pk=instance.pk).update(cell=cell):
+        locators.create(pk=instance.pk, cell=cell)
+        instance._allocated_locator = (instance.pk, None, False)
+    if moving:
+        # New coordinates in a cell of another shard; the old row is removed once saved.
+        instance._moved_from_shard = instance._state.db
+        instance._allocated_locator = (instance.pk, previous_cell, False)
+
+
+def restore_business_id(instance):
+    """
+        Undoes the locator changes allocate_business_id() made for a business
+        that then failed to save: a new id is released, a moved business is
+        located in its previous cell again.
+    """
+    instance.__dict__.pop('_moved_from_shard', None)
+    allocated = instance.__dict__.pop('_allocated_locator', None)
+    if allocated is None:
+        return
+    pk, previous_cell, generated = allocated
+    locator = BusinessLocator.objects.using(PRIMARY_DB).filter(pk=pk)
+    if previous_cell is None:
+        locator.delete()
+        if generated:
+            instance.pk = None
+    else:
+        locator.update(cell=previous_cell)
+
+
+def remove_moved_business(sender, instance, using, **kwargs):
+    """
+        post_save receiver deleting the previous copy of a business that changed shards.
+    """
+    instance.__dict__.pop('_allocated_locator', None)
+    previous = instance.__dict__.pop('_moved_from_shard', None)
+    if previous is not None:
+        with moving_rows():
+            Business.objects.using(previous).filter(pk=instance.pk).delete()
+
+
+def release_business_id(sender, instance, using, **kwargs):
+    """
+        post_delete receiver removing the BusinessLocator of a deleted business.
+    """
+    if using.startswith(SHARD_PREFIX) and not _moving_rows.get():
+        BusinessLocator.objects.using(PRIMARY_DB).filter(pk=instance.pk).delete()
+
+
+def _copy_missing(ids, source, target, batch_size):
+    copied = 0
+    for start in range(0, len(ids), batch_size):
+        batch = list(Business.objects.using(source).filter(pk__in=ids[start:start + batch_size]))
+        existing = set(Business.objects.using(target).filter(
+            pk__in=[business.pk for business in batch]).values_list('pk', flat=True))
+        missing = [business for business in batch if business.pk not in existing]
+        Business.objects.using(target).bulk_create(missing)
+        copied += len(missing)
+    return copied
+
+
+def move_cell(cell, target, wait=0, batch_size=1000):
+    """
+        Moves the businesses of a cell to another shard and reassigns the cell to it.
+
+        The rows are copied with their ids, then the cell is reassigned. After
+        `wait` seconds, long enough for every process to reload its shard map,
+        businesses created on the old shard in the meantime are copied as well
+        and the old rows are deleted. Copying skips rows the target already has,
+        so an interrupted move can simply be run again. Updates made during the
+        wait by processes still using the old assignment are not carried over.
+
+        Args:
+            cell (str): The cell to move.
+            target (str): The shard alias receiving it.
+            wait (float): Seconds to wait before removing the old rows.
+            batch_size (int): Rows copied and deleted per query.
+
+        Returns:
+            int: The number of businesses moved.
+    """
+    if target not in shard_aliases():
+        raise ValueError('Unknown shard %r.' % target)
+    shard_map.reload()
+    source = shard_map.shard_for_cell(cell)
+    if source == target:
+        return 0
+    locators = BusinessLocator.objects.using(PRIMARY_DB).filter(cell=cell)
+
+    moved = _copy_missing(list(locators.values_list('pk', flat=True)), source, target, batch_size)
+    ShardCell.objects.using(PRIMARY_DB).update_or_create(cell=cell, defaults={'shard': target})
+    shard_map.reload()
+    if wait:
+        time.sleep(wait)
+    ids = list(locators.values_list('pk', flat=True))
+    moved += _copy_missing(ids, source, target, batch_size)
+
+    with moving_rows():
+        for start in range(0, len(ids), batch_size):
+            Business.objects.using(source).filter(pk__in=ids[start:start + batch_size]).delete()
+    return moved
+
+
+def backfill_shards(batch_size=1000):
+    """
+        Moves the businesses stored in the primary's table, from before DB_SHARDS
+        was set, to the shards of their cells.
+
+        Every batch gets BusinessLocator rows with the businesses' ids, is copied
+        to the shards and then deleted from the primary. Rows already copied are
+        skipped, so an interrupted backfill can simply be run again. It should
+        run before the application serves traffic with sharding enabled, as new
+        businesses would otherwise be allocated ids the old ones still hold.
+
+        Raises:
+            ValueError: If an id of the primary's table was already allocated to
+                a business in another cell.
+
+        Returns:
+            int: The number of businesses moved.
+    """
+    if not sharding_enabled():
+        raise ValueError('No shards configured, set DB_SHARDS.')
+    primary = Business.objects.using(PRIMARY_DB)
+    locators = BusinessLocator.objects.using(PRIMARY_DB)
+    moved = 0
+    while True:
+        batch = list(primary.order_by('pk')[:batch_size])
+        if not batch:
+            break
+        cells = {business.pk: cell_for(business.latitude, business.longitude) for business in batch}
+        allocated = dict(locators.filter(pk__in=cells).values_list('pk', 'cell'))
+        conflicts = sorted(pk for pk, cell in allocated.items() if cells[pk] != cell)
+        if conflicts:
+            raise ValueError('Business ids %s are already allocated to other businesses.' % conflicts)
+        locators.bulk_create([BusinessLocator(pk=pk, cell=cell) for pk, cell in cells.items() if pk not in allocated])
+        by_shard = defaultdict(list)
+        for pk, cell in cells.items():
+            by_shard[shard_map.assign(cell, shard_map.shard_for_cell(cell))].append(pk)
+        for shard, ids in by_shard.items():
+            _copy_missing(ids, PRIMARY_DB, shard, batch_size)
+        with moving_rows():
+            primary.filter(pk__in=list(cells)).delete()
+        moved += len(batch)
+    # Ids are allocated after the highest one taken over from the primary's table.
+    connection = connections[PRIMARY_DB]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [BusinessLocator]):
+            cursor.execute(sql)
+    return moved
+
+
+def shard_loads():
+    """
+        Counts the businesses of every cell from the directory.
+
+        Returns:
+            dict: {shard alias: {cell: number of businesses}} for every shard.
+    """
+    shard_map.reload()
+    loads = {shard: {} for shard in shard_aliases()}
+    counts = BusinessLocator.objects.using(PRIMARY_DB).values_list('cell').annotate(businesses=Count('pk'))
+    for cell, businesses in counts:
+        loads[shard_map.shard_for_cell(cell)][cell] = businesses
+    return loads
+
+
+def plan_rebalance(loads, tolerance=0.05):
+    """
+        Plans cell moves evening out the number of businesses per shard.
+
+        Repeatedly moves a cell from the fullest to the emptiest shard, picking
+        the cell that leaves the smallest gap between the two. Planning ends when
+        no move narrows the gap by more than the tolerance.
+
+        Args:
+            loads (dict): The result of shard_loads().
+            tolerance (float): Improvement not worth a move, as a fraction of
+                the average number of businesses per shard.
+
+        Returns:
+            list: (cell, source, target, businesses) tuples in execution order.
+    """
+    cells = {shard: dict(shard_cells) for shard, shard_cells in loads.items()}
+    totals = {shard: sum(shard_cells.values()) for shard, shard_cells in cells.items()}
+    threshold = tolerance * sum(totals.values()) / max(len(totals), 1)
+    moves = []
+    while len(totals) > 1 and cells[max(totals, key=totals.get)]:
+        fullest = max(totals, key=totals.get)
+        emptiest = min(totals, key=totals.get)
+        gap = totals[fullest] - totals[emptiest]
+        cell = min(cells[fullest], key=lambda cell: abs(gap - 2 * cells[fullest][cell]))
+        businesses = cells[fullest][cell]
+        if gap - abs(gap - 2 * businesses) <= threshold:
+            break
+        del cells[fullest][cell]
+        cells[emptiest][cell] = businesses
+        totals[fullest] -= businesses
+        totals[emptiest] += businesses
+        moves.append((cell, fullest, emptiest, businesses))
+    return moves
+
+
+class BusinessShardRouter:
+    """
+        Places businesses on the shard assigned to their cell.
+
+        Saving a business routes it by its coordinates, so changing them to a
+        cell of another shard moves it there. Reads are routed for instances
+        loaded from a shard; queries have to name their shard with using(),
+        which the helpers of this module do, and raise ImproperlyConfigured
+        otherwise rather than silently reading the primary's empty table.
+        Other models are left to the next router. Shards only receive the
+        business table's migrations.
+    """
+
+    def __init__(self):
+        self.shards = shard_aliases()
+
+    def db_for_read(self, model, **hints):
+        if self.shards and model is Business:
+            instance = hints.get('instance')
+            if instance is not None and instance._state.db is not None:
+                return instance._state.db
+            raise ImproperlyConfigured(UNROUTED_QUERY)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if self.shards and model is Business:
+            instance = hints.get('instance')
+            if instance is not None:
+                return shard_map.shard_for_cell(cell_for(instance.latitude, instance.longitude))
+            raise ImproperlyConfigured(UNROUTED_QUERY)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db.startswith(SHARD_PREFIX):
+            return app_label == 'businesses' and model_name == 'business'
+        return None
@@ -1,3 +1,273 @@
-from django.test import TestCase
+import gzip
+import json
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from geopy import distance
+
+from mbapp.db import PRIMARY_DB
+from mbapp.querybudget import QueryBudget, QueryBudgetExceeded, assert_query_budget
+from user.models import User
+from user.utils import get_tokens_for_user
+from .admin import BusinessAdmin
+from .location_helpers import SEARCH_RADIUS_KM, filter_by_distance
+from .models import Business, BusinessLocator
+from .search import search_businesses
+from .serializers import BusinessSerializer
+from .views import BusinessExport
+from .sharding import (
+    all_shards, bulk_create_businesses, cell_for, fan_out, get_business, move_cell, plan_rebalance, query_shards,
+    shard_for_business, shard_loads, shard_map, sharding_enabled,
+)
+
+CENTER = (23.8103, 90.4125)
+
+
+class BusinessQueryBudgetTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('budget@example.com', 'password')
+        # A grid from roughly 0 to 40 km around the center, so only part of it is in range.
+        bulk_create_businesses([
+            Business(name='Business %d %d' % (i, j), location='Dhaka',
+                     latitude=round(CENTER[0] + i * 0.03, 6), longitude=round(CENTER[1] + j * 0.03, 6))
+            for i in range(-6, 7) for j in range(-6, 7)
+        ])
+
+    def setUp(self):
+        # Loaded once per BUSINESS_SHARD_MAP_TTL in a running process, not per request.
+        shard_map.reload()
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + get_tokens_for_user(self.user)['access']
+
+    def test_filter_by_distance_matches_full_scan(self):
+        expected = {
+            business.pk for business in query_shards(Business.objects.all(), all_shards())
+            if distance.distance(CENTER, (business.latitude, business.longitude)).km <= SEARCH_RADIUS_KM
+        }
+        with assert_query_budget(max_queries=1, max_rows=len(expected) * 2):
+            nearby = filter_by_distance(*CENTER)
+        self.assertEqual({business.pk for business in nearby}, expected)
+
+    @mock.patch('businesses.location_helpers.get_geocoder')
+    def test_business_list_budget(self, get_geocoder):
+        get_geocoder.return_value.geocode.return_value = mock.Mock(latitude=CENTER[0], longitude=CENTER[1])
+        with assert_query_budget(max_queries=2, max_rows=50):
+            response = self.client.get('/businesses/', {'location': 'Dhaka'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_business_detail_budget(self):
+        business = query_shards(Business.objects.all(), all_shards())[0]
+        # Sharded lookups first read the business's cell from the primary.
+        locator = int(sharding_enabled())
+        with assert_query_budget(max_queries=2 + locator, max_rows=2 + locator):
+            response = self.client.get('/businesses/%d/' % business.pk)
+        self.assertEqual(response.status_code, 200)
+
+
+class FanOutTest(SimpleTestCase):
+    databases = {PRIMARY_DB}
+
+    def test_pool_thread_queries_are_counted(self):
+        def select_one(alias):
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                return cursor.fetchone()[0]
+
+        with assert_query_budget(allow_repeated=True) as counter:
+            self.assertEqual(fan_out(select_one, [PRIMARY_DB, PRIMARY_DB]), [1, 1])
+        # New pool connections also count the SQLITE_PRAGMAS they set.
+        self.assertEqual((counter.statements[PRIMARY_DB, 'SELECT 1'], counter.rows), (2, 2))
+
+    def test_one_query_per_shard_is_not_repeated(self):
+        with assert_query_budget(max_queries=3) as counter:
+            for alias in ('shard_0', 'shard_1', 'shard_2'):
+                counter(lambda *args: None, 'SELECT 1', (), False, {'connection': mock.Mock(alias=alias),
+                                                                     'cursor': mock.Mock()})
+        self.assertEqual(counter.repeated(threshold=2), {})
+
+
+class BusinessSearchTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_create_businesses([
+            Business(name='Coffee House', location='Gulshan, Dhaka', latitude=CENTER[0], longitude=CENTER[1]),
+            Business(name='Bakery', location='Coffee Road, Dhaka', latitude=CENTER[0], longitude=CENTER[1]),
+            Business(name='Coffee Corner', location='Chittagong', latitude=22.3569, longitude=91.7832),
+            Business(name='Tea Stall', location='Dhaka', latitude=CENTER[0], longitude=CENTER[1]),
+        ])
+
+    def test_prefix_search_ranks_name_matches_first(self):
+        names = [business.name for business in search_businesses('coff')]
+        self.assertEqual(set(names[:2]), {'Coffee House', 'Coffee Corner'})
+        self.assertEqual(names[2:], ['Bakery'])
+
+    def test_search_within_radius(self):
+        names = [business.name for business in search_businesses('coffee dha', near=CENTER)]
+        self.assertEqual(names, ['Coffee House', 'Bakery'])
+
+    def test_index_follows_updates(self):
+        Business.objects.filter(name='Tea Stall').update(name='Coffee Stall')
+        self.assertIn('Coffee Stall', [business.name for business in search_businesses('coffee')])
+
+    @override_settings(RATELIMIT_ENABLED=True, RATELIMIT_RATES={'geocode': '1/m'})
+    @mock.patch('businesses.location_helpers.get_geocoder')
+    def test_only_location_searches_use_geocode_limit(self, get_geocoder):
+        get_geocoder.return_value.geocode.return_value = mock.Mock(latitude=CENTER[0], longitude=CENTER[1])
+        cache.clear()
+        user = User.objects.create_user('search@example.com', 'password')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + get_tokens_for_user(user)['access']
+        searches = [self.client.get('/businesses/', {'q': 'coffee'}).status_code for _ in range(3)]
+        self.assertEqual(searches, [200, 200, 200])
+        located = [self.client.get('/businesses/', {'location': 'Dhaka'}).status_code for _ in range(2)]
+        self.assertEqual(located, [200, 429])
+
+
+class BusinessExportTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('export@example.com', 'password')
+        bulk_create_businesses([
+            Business(name='Business %d' % i, location='Dhaka', latitude=CENTER[0], longitude=CENTER[1])
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        shard_map.clear()
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + get_tokens_for_user(self.user)['access']
+
+    @override_settings(STREAMING_CHUNK_SIZE=10)
+    def test_export_streams_gzip_ndjson(self):
+        response = self.client.get('/businesses/export/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Business %d' % i for i in range(25)])
+        first = json.loads(lines[0])
+        self.assertEqual(first, BusinessSerializer(get_business(first['id'])).data)
+
+    @override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True, STREAMING_CHUNK_SIZE=10)
+    def test_export_stream_counts_against_budget(self):
+        response = self.client.get('/businesses/export/')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 25)
+        # The queries run while the body is read, after the middleware returned.
+        with mock.patch.object(BusinessExport, 'query_budget', QueryBudget(max_queries=1)):
+            response = self.client.get('/businesses/export/')
+            with self.assertRaises(QueryBudgetExceeded):
+                b''.join(response.streaming_content)
+
+
+class PlanRebalanceTest(TestCase):
+
+    def test_moves_cells_until_even(self):
+        loads = {'shard_0': {'a': 40, 'b': 30, 'c': 20}, 'shard_1': {'d': 10}, 'shard_2': {}}
+        moves = plan_rebalance(loads, tolerance=0.1)
+        self.assertEqual(moves, [('a', 'shard_0', 'shard_2', 40), ('c', 'shard_0', 'shard_1', 20)])
+
+
+@skipUnless(len(all_shards()) > 1, 'Needs at least two shards, as configured by mbapp.settings_test.')
+class ShardingTest(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        shard_map.clear()
+
+    def test_business_follows_its_cell(self):
+        business = Business.objects.create(name='Cafe', location='Dhaka', latitude=CENTER[0], longitude=CENTER[1])
+        shard = shard_for_business(business.pk)
+        self.assertEqual(business._state.db, shard)
+
+        business.latitude, business.longitude = 52.52, 13.405
+        business.save()
+        self.assertEqual(shard_for_business(business.pk), shard_map.shard_for_cell(cell_for(52.52, 13.405)))
+        self.assertEqual(sum(Business.objects.using(alias).filter(pk=business.pk).count() for alias in all_shards()), 1)
+
+        get_business(business.pk).delete()
+        self.assertFalse(BusinessLocator.objects.filter(pk=business.pk).exists())
+
+    def test_radius_query_and_rebalance(self):
+        # Businesses on both sides of a cell border, so the circle spans two cells.
+        bulk_create_businesses([
+            Business(name='Business %d' % i, location='Border', latitude=24 + (i - 10) * 0.004, longitude=90.5)
+            for i in range(20)
+        ])
+        self.assertEqual(len(filter_by_distance(24.0, 90.5)), 20)
+
+        loads = shard_loads()
+        cell, source = next((cell, shard) for shard, cells in loads.items() for cell in cells if cell == '24:90')
+        target = next(shard for shard in all_shards() if shard != source)
+        self.assertEqual(move_cell(cell, target), loads[source][cell])
+        self.assertFalse(Business.objects.using(source).filter(latitude__gte=24).exists())
+        self.assertEqual(len(filter_by_distance(24.0, 90.5)), 20)
+        self.assertEqual(BusinessLocator.objects.count(), 20)
+
+    def test_failed_inserts_release_their_ids(self):
+        with mock.patch.object(Business, '_do_insert', side_effect=DatabaseError('shard down')), \
+                self.assertRaises(DatabaseError):
+            Business.objects.create(name='Cafe', location='Dhaka', latitude=CENTER[0], longitude=CENTER[1])
+        with mock.patch('businesses.models.BusinessQuerySet.bulk_create', side_effect=DatabaseError('shard down')), \
+                self.assertRaises(DatabaseError):
+            bulk_create_businesses([Business(name='Bakery', location='Dhaka', latitude=CENTER[0], longitude=CENTER[1])])
+        self.assertFalse(BusinessLocator.objects.exists())
+
+        business = Business.objects.create(name='Cafe', location='Dhaka', latitude=CENTER[0], longitude=CENTER[1])
+        shard = business._state.db
+        business.latitude, business.longitude = 52.52, 13.405
+        with mock.patch.object(Business, '_do_insert', side_effect=DatabaseError('shard down')), \
+                self.assertRaises(DatabaseError):
+            business.save()
+        self.assertEqual(shard_for_business(business.pk), shard)
+        self.assertEqual(get_business(business.pk).name, 'Cafe')
+
+    def test_backfill_moves_unsharded_businesses(self):
+        # Stored in the default database before sharding was enabled.
+        Business.objects.using(PRIMARY_DB).bulk_create([
+            Business(pk=pk, name='Legacy %d' % pk, location='Grid', latitude=pk * 5, longitude=pk * 5)
+            for pk in range(1, 8)
+        ])
+        call_command('rebalance_shards', '--backfill', '--batch-size', '3', stdout=StringIO())
+        self.assertFalse(Business.objects.using(PRIMARY_DB).exists())
+        self.assertEqual([get_business(pk).name for pk in range(1, 8)], ['Legacy %d' % pk for pk in range(1, 8)])
+        self.assertGreater(sum(1 for cells in shard_loads().values() if cells), 1)
+        business = Business.objects.create(name='New', location='Dhaka', latitude=CENTER[0], longitude=CENTER[1])
+        self.assertGreater(business.pk, 7)
+
+    # The manifest storage needs collectstatic to render admin pages.
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_unrouted_queries_and_admin(self):
+        bulk_create_businesses([
+            Business(name='Business %d' % i, location='Grid', latitude=i * 5, longitude=i * 5) for i in range(10)
+        ])
+        self.assertGreater(sum(1 for cells in shard_loads().values() if cells), 1)
+        with self.assertRaises(ImproperlyConfigured):
+            list(Business.objects.all())
+        self.assertEqual(Business.objects.count(), 10)
+        self.assertEqual(Business.objects.filter(location='Grid').update(location='Map'), 10)
+
+        self.client.force_login(User.objects.create_superuser('admin@example.com', 'password'))
+        response = self.client.get('/admin/businesses/business/', {'q': 'Business'})
+        self.assertEqual([business.name for business in response.context['cl'].result_list],
+                         ['Business %d' % i for i in reversed(range(10))])
+        with mock.patch.object(BusinessAdmin, 'list_per_page', 4):
+            response = self.client.get('/admin/businesses/business/', {'p': 2})
+        self.assertEqual([business.name for business in response.context['cl'].result_list],
+                         ['Business %d' % i for i in (5, 4, 3, 2)])
+        business = query_shards(Business.objects.filter(name='Business 3'), all_shards())[0]
+        response = self.client.post('/admin/businesses/business/%d/change/' % business.pk, {
+            'name': 'Moved', 'location': 'Berlin', 'latitude': '52.52', 'longitude': '13.405',
+        })
+        self.assertEqual(response.status_code, 302)
+        moved = get_business(business.pk)
+        self.assertEqual((moved.name, moved._state.db), ('Moved', shard_map.shard_for_cell(cell_for(52.52, 13.405))))
+        response = self.client.post('/admin/businesses/business/%d/delete/' % business.pk, {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Business.objects.count(), 9)
@@ -4,4 +4,5 @@ from .views import *
 urlpatterns = [
     path('businesses/', BusinessList.as_view()),
     path('businesses/<int:pk>/', BusinessDetail.as_view()),
+    path('businesses/export/', BusinessExport.as_view()),
 ]
@@ -1,15 +1,25 @@
+from operator import itemgetter
+
+from django.conf import settings
 from django.http import Http404
-from geopy.geocoders import Bing
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from mbapp.settings import BING_MAPS_API_KEY
-from .location_helpers import filter_by_distance, geocode_location
+from mbapp.querybudget import query_budget
+from mbapp.ratelimit import rate_limit
+from mbapp.streaming import NDJSONRenderer, StreamingJSONResponse
+from mbapp.tracing import span
+from .location_helpers import filter_by_distance, geocode_location, in_bounding_box, iter_within_radius, nearby_shards
 from .models import Business
-from .serializers import BusinessSerializer
+from .search import search_businesses
+from .serializers import BusinessSerializer, business_rows
+from .sharding import all_shards, get_business, iterate_shards
 
 
+@query_budget(max_queries=3)
 class BusinessDetail(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -20,7 +30,7 @@ class BusinessDetail(APIView):
             :return: Business object for the given pk.
         """
         try:
-            return Business.objects.get(pk=pk)
+            return get_business(pk)
         except Business.DoesNotExist:
             raise Http404
 
@@ -61,15 +71,27 @@ class BusinessDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def _geocodes(request):
+    # Creating a business geocodes its location, listing only when given one.
+    return request.method == 'POST' or bool(request.GET.get('location'))
+
+
+@rate_limit('geocode', key='user', condition=_geocodes)
+@query_budget(max_queries=3)
 class BusinessList(APIView):
     permission_classes = [IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
 
     def get(self, request):
         """
-            Retrieves a list of businesses near a given location. The location is extracted
-            from the request's query parameters. If a valid location is provided, the
-            view will call an external API for geocoding and filter the Business model
-            by distance. If no businesses are found, a 404 status response will be returned.
+            Retrieves a list of businesses near a given location, matching a text query, or both.
+            The location is extracted from the request's query parameters. If a valid location
+            is provided, the view will call an external API for geocoding and filter the Business
+            model by distance. A `q` parameter searches business names and locations through the
+            full-text index, best match first, and is restricted to the radius when combined with
+            a location. If no businesses are found, a 404 status response will be returned.
+            Clients accepting application/x-ndjson get the radius results streamed, compressed
+            when they accept gzip or brotli, and an empty stream instead of the 404.
             If there is an issue with the location query or external API call, a 400 status
             response will be returned.
 
@@ -81,23 +103,31 @@ class BusinessList(APIView):
 
         """
         location_str = request.query_params.get('location')
+        query = request.query_params.get('q')
         if location_str:
             try:
-                geolocator = Bing(api_key=BING_MAPS_API_KEY)
-                location = geolocator.geocode(location_str)
-                if location is None:
+                lat, lon = geocode_location(location_str)
+                if lat is None:
                     return Response({'detail': 'Invalid location1.'}, status=status.HTTP_400_BAD_REQUEST)
-                lat = location.latitude
-                lon = location.longitude
             except:
                 return Response({'detail': 'Invalid location2.'}, status=status.HTTP_400_BAD_REQUEST)
-            nearby_businesses = filter_by_distance(lat, lon)
-            if not nearby_businesses:
-                return Response({'detail': 'No nearby businesses found.'}, status=status.HTTP_404_NOT_FOUND)
-            serializer = BusinessSerializer(nearby_businesses, many=True)
-            return Response(serializer.data)
+            if query:
+                nearby_businesses = search_businesses(query, near=(lat, lon))
+            elif request.accepted_renderer.format == NDJSONRenderer.format:
+                candidates = iterate_shards(in_bounding_box(lat, lon), nearby_shards(lat, lon),
+                                            settings.STREAMING_CHUNK_SIZE)
+                return StreamingJSONResponse(request, business_rows(iter_within_radius(candidates, lat, lon)))
+            else:
+                nearby_businesses = filter_by_distance(lat, lon)
+        elif query:
+            nearby_businesses = search_businesses(query)
         else:
             return Response({'detail': 'Missing location.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not nearby_businesses:
+            return Response({'detail': 'No nearby businesses found.'}, status=status.HTTP_404_NOT_FOUND)
+        with span('serialize'):
+            data = BusinessSerializer(nearby_businesses, many=True).data
+        return Response(data)
 
     def post(self, request):
         """
@@ -121,3 +151,27 @@ class BusinessList(APIView):
             serializer.save(latitude=latitude, longitude=longitude)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# The user's lookup, then one cursor per shard.
+@query_budget(max_queries=1 + len(all_shards()))
+class BusinessExport(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [NDJSONRenderer, JSONRenderer]
+
+    def get(self, request):
+        """
+            Exports the full business catalog as newline delimited JSON, ordered by id.
+            The rows are read through server-side cursors, merged across shards and
+            streamed, gzip or brotli compressed when the client accepts it, so memory
+            use stays flat whatever the size of the catalog.
+
+            Parameters: request (HttpRequest): The request object sent to the server.
+
+            Returns:  StreamingHttpResponse: One JSON object per business and line.
+        """
+        rows = Business.objects.order_by('pk').values(*BusinessSerializer.Meta.fields)
+        rows = iterate_shards(rows, all_shards(), settings.STREAMING_CHUNK_SIZE, key=itemgetter('id'))
+        response = StreamingJSONResponse(request, rows)
+        response['Content-Disposition'] = 'attachment; filename="businesses.ndjson"'
+        return response
@@ -0,0 +1,86 @@
+"""
+Gunicorn configuration for serving mbapp in production.
+
+    gunicorn -c gunicorn.conf.py mbapp.wsgi
+
+The Django application is imported once in the master process and the workers
+are forked from it, so they share the loaded code copy-on-write and start
+without re-importing anything. Every value can be overridden from the
+environment or the .env file.
+"""
+import gc
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+
+# Imported as a module: gunicorn reads a top-level `config` name as its own setting.
+import decouple
+
+bind = decouple.config('GUNICORN_BIND', default='0.0.0.0:8000')
+workers = decouple.config('GUNICORN_WORKERS', default=multiprocessing.cpu_count() * 2 + 1, cast=int)
+# Threaded workers keep idle client connections open for `keepalive` seconds.
+worker_class = 'gthread'
+threads = decouple.config('GUNICORN_THREADS', default=4, cast=int)
+keepalive = decouple.config('GUNICORN_KEEPALIVE', default=5, cast=int)
+
+# Recycle each worker after roughly max_requests requests, jittered so the
+# workers do not all restart at once.
+max_requests = decouple.config('GUNICORN_MAX_REQUESTS', default=10000, cast=int)
+max_requests_jitter = decouple.config('GUNICORN_MAX_REQUESTS_JITTER', default=1000, cast=int)
+
+timeout = decouple.config('GUNICORN_TIMEOUT', default=30, cast=int)
+# On SIGTERM workers stop accepting connections and get this long to finish in-flight requests.
+graceful_timeout = decouple.config('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+
+preload_app = True
+accesslog = decouple.config('GUNICORN_ACCESSLOG', default='-')
+
+# Workers write their metrics here for /metrics to sum them, see mbapp.metrics.Registry. The
+# directory is emptied whenever gunicorn starts, so it must not be shared with another server.
+metrics_dir = decouple.config('METRICS_MULTIPROCESS_DIR', default=os.path.join(tempfile.gettempdir(), 'mbapp-metrics'))
+os.environ['METRICS_MULTIPROCESS_DIR'] = metrics_dir
+
+
+def on_starting(server):
+    """
+        Empties the metrics directory of snapshots left by a previous run.
+    """
+    directory = Path(metrics_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    for path in directory.iterdir():
+        if path.is_file():
+            path.unlink()
+
+
+def when_ready(server):
+    """
+        Warms the preloaded application before the first worker is forked.
+    """
+    from django.db import connections
+    from django.urls import get_resolver
+
+    from mbapp.metrics import registry
+    from mbapp.schema import get_compiled_schema
+
+    # Import every view module and build the URL resolver once, in the master.
+    get_resolver().url_patterns
+    try:
+        get_compiled_schema()
+    except Exception:
+        server.log.exception("Could not precompile the OpenAPI schema, workers will compile it on demand.")
+    # Only the workers report metrics.
+    registry.discard()
+    # Workers must open their own database connections rather than inherit one.
+    connections.close_all()
+    # Move everything allocated so far out of the collector's reach so garbage
+    # collections in the workers do not touch, and thereby copy, shared pages.
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    from mbapp.metrics import registry
+    from user.activity import tracker
+
+    tracker.flush()
+    registry.flush()
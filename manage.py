@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mbapp.settings")
+    # The test suite runs with mbapp.settings_test unless --settings or the environment says otherwise.
+    default_settings = "mbapp.settings_test" if sys.argv[1:2] == ["test"] else "mbapp.settings"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
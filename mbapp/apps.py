@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+
+
+class MbappConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "mbapp"
+
+    def ready(self):
+        from django.core import checks
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        from mbapp.db import apply_sqlite_pragmas, reset_primary_pinning
+        from mbapp.middleware import check_session_middleware, check_session_security
+        connection_created.connect(apply_sqlite_pragmas)
+        request_started.connect(reset_primary_pinning)
+        checks.register(check_session_middleware, checks.Tags.admin)
+        checks.register(check_session_security, checks.Tags.security, deploy=True)
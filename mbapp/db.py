@@ -0,0 +1,111 @@
+import random
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar, copy_context
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY_DB = 'default'
+REPLICA_PREFIX = 'replica_'
+SHARD_PREFIX = 'shard_'
+
+_pinned_to_primary = ContextVar('mbapp_pinned_to_primary', default=False)
+_execute_wrappers = ContextVar('mbapp_execute_wrappers', default=())
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+        Applies settings.SQLITE_PRAGMAS to every new SQLite connection.
+
+        Connected to the connection_created signal; connections to other
+        database vendors are left untouched.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA %s = %s' % (pragma, value))
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """
+        Installs an execute wrapper on every database connection of the current
+        thread and, while active, of the threads running functions wrapped with
+        bind_context(), such as the shard queries of businesses.sharding.fan_out.
+    """
+    token = _execute_wrappers.set(_execute_wrappers.get() + (wrapper,))
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            yield
+    finally:
+        _execute_wrappers.reset(token)
+
+
+def _call_with_execute_wrappers(func, *args):
+    with ExitStack() as stack:
+        for wrapper in _execute_wrappers.get():
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+        return func(*args)
+
+
+def bind_context(func):
+    """
+        Returns a callable running func in a copy of the current context, for
+        use from another thread, with the active execute wrappers installed on
+        that thread's connections.
+    """
+    context = copy_context()
+    return lambda *args: context.run(_call_with_execute_wrappers, func, *args)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith(REPLICA_PREFIX)]
+
+
+def shard_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith(SHARD_PREFIX)]
+
+
+def reset_primary_pinning(**kwargs):
+    """
+        Unpins the current request from the primary. Connected to request_started.
+    """
+    _pinned_to_primary.set(False)
+
+
+def pin_to_primary():
+    _pinned_to_primary.set(True)
+
+
+class ReadWriteRouter:
+    """
+        Sends writes to the primary database and spreads reads over the replicas.
+
+        Every replica_<n> database alias is treated as a read replica.
+        Once a request has written anything, its later reads go to the primary
+        too, so a request always sees its own writes despite replication lag.
+        Without replicas configured every query goes to the primary.
+    """
+
+    def __init__(self):
+        self.replicas = replica_aliases()
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or _pinned_to_primary.get():
+            return PRIMARY_DB
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from any of them may be related.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DB
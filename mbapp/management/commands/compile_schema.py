@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from mbapp.schema import compile_schema
+
+
+class Command(BaseCommand):
+    help = "Precompile the OpenAPI schema served at /api/schema/ for the current code version."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate even if the schema is up to date.")
+
+    def handle(self, *args, **options):
+        schema = compile_schema(force=options['force'])
+        sizes = ', '.join(
+            '%s %d bytes (%d gzipped)' % (fmt, len(document['plain']), len(document['gzip']))
+            for fmt, document in schema.documents.items()
+        )
+        self.stdout.write(self.style.SUCCESS('Compiled schema %s: %s.' % (schema.code_hash, sizes)))
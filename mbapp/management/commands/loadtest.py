@@ -0,0 +1,288 @@
+import http.client
+import io
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+
+from benchmarks.stats import summarize
+from benchmarks.stubs import patch_geocoder
+
+DEFAULT_MIX = 'signin=1,refresh=1,search=6,detail=4,create=1'
+
+
+class WSGITransport:
+    """
+        Calls the Django WSGI application in-process, exercising the same
+        middleware and handler stack as a WSGI server would.
+    """
+
+    def __init__(self):
+        self.application = get_wsgi_application()
+
+    def request(self, method, path, query=None, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': urlencode(query or {}),
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(data)),
+            'wsgi.input': io.BytesIO(data),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in (headers or {}).items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        status = []
+        response = self.application(environ, lambda status_line, response_headers: status.append(status_line))
+        try:
+            content = b''.join(response)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return int(status[0].split(' ', 1)[0]), content
+
+
+class HTTPTransport:
+    """
+        Sends requests to a running server, one keep-alive connection per worker.
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        if parts.scheme != 'http':
+            raise CommandError('Only http:// URLs are supported.')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, query=None, body=None, headers=None):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        url = self.prefix + path + ('?' + urlencode(query) if query else '')
+        headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        try:
+            connection.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+
+
+class Worker:
+    """
+        A simulated client holding its own tokens and issuing the request mix.
+    """
+
+    def __init__(self, transport, options, rng):
+        self.transport = transport
+        self.options = options
+        self.rng = rng
+        self.access = None
+        self.refresh = None
+        self.business_ids = list(options['business_ids'])
+
+    def sign_in(self):
+        status, content = self.transport.request('POST', '/user/api/signin/', body={
+            'email': self.options['email'], 'password': self.options['password'],
+        })
+        if status != 200:
+            return status
+        tokens = json.loads(content)['data']
+        self.access, self.refresh = tokens['access'], tokens['refresh']
+        return status
+
+    def auth_headers(self):
+        return {'Authorization': 'Bearer %s' % self.access}
+
+    def refresh_token(self):
+        status, content = self.transport.request('POST', '/api/token/refresh/', body={'refresh': self.refresh})
+        if status == 200:
+            self.access = json.loads(content)['access']
+        return status
+
+    def search(self):
+        return self.transport.request('GET', '/businesses/', query={'location': self.options['location']},
+                                      headers=self.auth_headers())[0]
+
+    def detail(self):
+        if not self.business_ids:
+            return self.create()
+        business_id = self.rng.choice(self.business_ids)
+        return self.transport.request('GET', '/businesses/%d/' % business_id, headers=self.auth_headers())[0]
+
+    def create(self):
+        status, content = self.transport.request('POST', '/businesses/', body={
+            'name': 'Loadtest %d' % self.rng.randrange(10 ** 9), 'location': self.options['location'],
+        }, headers=self.auth_headers())
+        if status == 201:
+            self.business_ids.append(json.loads(content)['id'])
+        return status
+
+    def run(self, kind):
+        return {
+            'signin': self.sign_in,
+            'refresh': self.refresh_token,
+            'search': self.search,
+            'detail': self.detail,
+            'create': self.create,
+        }[kind]()
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in ('signin', 'refresh', 'search', 'detail', 'create'):
+            raise CommandError('Unknown request kind "%s" in --mix.' % kind)
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate concurrent load against the API, either in-process through the WSGI "
+        "application or against a running server, and report throughput, latency "
+        "percentiles and error rates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://localhost:8000. "
+                                          "Without it requests go through the WSGI application in-process.")
+        parser.add_argument('--email', required=True, help="Email of the user the workers sign in as.")
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent workers.")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to generate load for.")
+        parser.add_argument('--mix', default=DEFAULT_MIX, help="Weighted request mix, default %s." % DEFAULT_MIX)
+        parser.add_argument('--location', default='Dhaka', help="Location searched and used for created businesses.")
+        parser.add_argument('--business-id', type=int, action='append', default=[], dest='business_ids',
+                            help="Business id requested by detail requests, can be repeated.")
+        parser.add_argument('--stub-geocoder', action='store_true',
+                            help="In-process only: resolve locations locally instead of calling Bing Maps.")
+        parser.add_argument('--rate-limits', action='store_true',
+                            help="Keep rate limiting on in-process, where every worker shares one client address.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', help="Write the report as JSON to this file, '-' for stdout.")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be a positive integer.')
+        if options['url'] and options['stub_geocoder']:
+            raise CommandError('--stub-geocoder only applies to in-process load tests.')
+        mix = parse_mix(options['mix'])
+        kinds, weights = list(mix), list(mix.values())
+        # Rate limiting is switched off before the in-process application loads its middleware.
+        in_process_limits = options['url'] or options['rate_limits']
+        with override_settings(RATELIMIT_ENABLED=False) if not in_process_limits else nullcontext(), \
+                patch_geocoder() if options['stub_geocoder'] else nullcontext():
+            transport = HTTPTransport(options['url']) if options['url'] else WSGITransport()
+            workers = [Worker(transport, options, random.Random(options['seed'] + i))
+                       for i in range(options['concurrency'])]
+            # Tokens are obtained before the timed phase so every request kind
+            # starts from an authenticated client.
+            for worker in workers:
+                status = worker.sign_in()
+                if status != 200:
+                    raise CommandError('Sign in as %s failed with status %d.' % (options['email'], status))
+            report = self.run_load(workers, kinds, weights, options['duration'])
+
+        self.print_report(report)
+        if options['json_path']:
+            payload = json.dumps(report, indent=2)
+            if options['json_path'] == '-':
+                self.stdout.write(payload)
+            else:
+                with open(options['json_path'], 'w') as handle:
+                    handle.write(payload)
+
+    def run_load(self, workers, kinds, weights, duration):
+        lock = threading.Lock()
+        latencies = defaultdict(list)
+        statuses = defaultdict(lambda: defaultdict(int))
+        deadline = time.perf_counter() + duration
+
+        def work(worker):
+            local_latencies = defaultdict(list)
+            local_statuses = defaultdict(lambda: defaultdict(int))
+            while time.perf_counter() < deadline:
+                kind = worker.rng.choices(kinds, weights)[0]
+                started = time.perf_counter()
+                try:
+                    status = str(worker.run(kind))
+                except Exception as e:
+                    status = type(e).__name__
+                local_latencies[kind].append(time.perf_counter() - started)
+                local_statuses[kind][status] += 1
+            with lock:
+                for kind, samples in local_latencies.items():
+                    latencies[kind].extend(samples)
+                    for status, count in local_statuses[kind].items():
+                        statuses[kind][status] += count
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in workers]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        def errors(counts):
+            return sum(count for status, count in counts.items() if not (status.isdigit() and int(status) < 400))
+
+        total = sum(len(samples) for samples in latencies.values())
+        total_errors = sum(errors(counts) for counts in statuses.values())
+        report = {
+            'concurrency': len(workers),
+            'duration_s': elapsed,
+            'requests': total,
+            'throughput_rps': total / elapsed if elapsed else 0.0,
+            'error_rate': total_errors / total if total else 0.0,
+            'latency': summarize([sample for samples in latencies.values() for sample in samples]),
+            'kinds': {},
+        }
+        for kind, samples in latencies.items():
+            report['kinds'][kind] = dict(
+                summarize(samples),
+                throughput_rps=len(samples) / elapsed,
+                error_rate=errors(statuses[kind]) / len(samples),
+                statuses=dict(statuses[kind]),
+            )
+        return report
+
+    def print_report(self, report):
+        self.stdout.write('%d requests in %.1fs with %d workers: %.1f req/s, %.2f%% errors' % (
+            report['requests'], report['duration_s'], report['concurrency'],
+            report['throughput_rps'], report['error_rate'] * 100))
+        self.stdout.write('%-10s %8s %10s %10s %10s %10s %8s  %s' % (
+            'kind', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', 'statuses'))
+        rows = list(report['kinds'].items()) + [('all', dict(report['latency'], throughput_rps=report['throughput_rps'],
+                                                              error_rate=report['error_rate'], statuses={}))]
+        for kind, stats in rows:
+            self.stdout.write('%-10s %8d %10.1f %10.2f %10.2f %10.2f %7.2f%%  %s' % (
+                kind, stats['samples'], stats['throughput_rps'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['error_rate'] * 100,
+                ' '.join('%s:%d' % item for item in sorted(stats['statuses'].items()))))
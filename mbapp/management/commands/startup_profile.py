@@ -0,0 +1,104 @@
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Boots the app the way a WSGI worker does: settings, app registry, URLconf
+# (which imports every view) and the WSGI handler with its middleware.
+BOOT_SCRIPT = (
+    "import os; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mbapp.settings');"
+    "from django.core.wsgi import get_wsgi_application;"
+    "application = get_wsgi_application();"
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+
+class ImportNode:
+    def __init__(self, name, self_us, cumulative_us, depth):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+        self.children = []
+
+
+def parse_import_times(output):
+    """
+        Builds the import tree from `python -X importtime` output.
+
+        The interpreter reports a module after all the modules it imported, one
+        indentation level deeper, so children are collected from a stack.
+
+        Returns:
+            list: The top level ImportNode objects in import order.
+    """
+    pending = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        node = ImportNode(name, int(self_us), int(cumulative_us), len(indent) // 2)
+        while pending and pending[-1].depth > node.depth:
+            node.children.insert(0, pending.pop())
+        pending.append(node)
+    return pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot the application in a fresh interpreter and report the import time of "
+        "every module as a tree, together with the total cold start time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-ms', type=float, default=2.0,
+                            help="Hide modules whose cumulative import time is below this.")
+        parser.add_argument('--depth', type=int, default=4, help="Maximum tree depth shown.")
+        parser.add_argument('--runs', type=int, default=3, help="Boots measured; the fastest is reported.")
+        parser.add_argument('--budget-ms', type=float, default=getattr(settings, 'STARTUP_BUDGET_MS', None),
+                            help="Fail when the cold start takes longer than this.")
+
+    def handle(self, *args, **options):
+        best = None
+        for _ in range(max(1, options['runs'])):
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT],
+                cwd=settings.BASE_DIR, env=dict(os.environ), capture_output=True, text=True,
+            )
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if result.returncode != 0:
+                raise CommandError('Application boot failed:\n%s' % result.stderr[-2000:])
+            if best is None or elapsed_ms < best[0]:
+                best = (elapsed_ms, result.stderr)
+
+        elapsed_ms, output = best
+        roots = parse_import_times(output)
+        import_ms = sum(root.cumulative_us for root in roots) / 1000
+
+        self.stdout.write('%10s %10s  %s' % ('cumul ms', 'self ms', 'module'))
+        for root in sorted(roots, key=lambda node: node.cumulative_us, reverse=True):
+            self._write_node(root, 0, options)
+        self.stdout.write('')
+        self.stdout.write('Imports: %.1fms, cold start (interpreter, imports and app setup): %.1fms' % (
+            import_ms, elapsed_ms))
+
+        budget = options['budget_ms']
+        if budget is not None:
+            if elapsed_ms > budget:
+                raise CommandError('Cold start of %.1fms exceeds the %.1fms budget.' % (elapsed_ms, budget))
+            self.stdout.write(self.style.SUCCESS('Within the %.1fms cold start budget.' % budget))
+
+    def _write_node(self, node, level, options):
+        if node.cumulative_us / 1000 < options['min_ms'] or level >= options['depth']:
+            return
+        self.stdout.write('%10.1f %10.1f  %s%s' % (
+            node.cumulative_us / 1000, node.self_us / 1000, '  ' * level, node.name))
+        for child in sorted(node.children, key=lambda child: child.cumulative_us, reverse=True):
+            self._write_node(child, level + 1, options)
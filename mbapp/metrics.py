@@ -0,0 +1,377 @@
+import atexit
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+
+from mbapp.db import execute_wrapper
+from mbapp.middleware import ObservedStream
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+        Base class of registry metrics: a name, help text, label names and one
+        value per distinct combination of label values.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError('%s expects labels %s, got %r' % (self.name, self.labelnames, labels))
+        return tuple(str(label) for label in labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+    def merge(self, samples, into):
+        raise NotImplementedError
+
+    def render(self, samples):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, samples, into):
+        for key, value in samples.items():
+            into[key] = into.get(key, 0) + value
+
+    def render(self, samples):
+        for key, value in sorted(samples.items()):
+            yield '%s%s %s' % (self.name, _format_labels(self.labelnames, json.loads(key)), _format_value(value))
+
+
+class Histogram(Metric):
+    """
+        A histogram with fixed bucket upper bounds. Each sample stores the
+        non-cumulative count per bucket followed by the sum and total count.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, labels=()):
+        key = self._key(labels)
+        index = len(self.buckets) - 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            sample[index] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    def _copy(self, value):
+        return list(value)
+
+    def merge(self, samples, into):
+        for key, value in samples.items():
+            current = into.get(key)
+            into[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+
+    def render(self, samples):
+        for key, sample in sorted(samples.items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, sample):
+                cumulative += count
+                yield '%s_bucket%s %d' % (
+                    self.name, _format_labels(self.labelnames, labels, [('le', _format_value(bound))]), cumulative)
+            yield '%s_sum%s %s' % (self.name, _format_labels(self.labelnames, labels), _format_value(sample[-2]))
+            yield '%s_count%s %d' % (self.name, _format_labels(self.labelnames, labels), sample[-1])
+
+
+class Registry:
+    """
+        Process-local collection of metrics.
+
+        With settings.METRICS_MULTIPROCESS_DIR set, every worker periodically
+        writes a snapshot of its metrics to <dir>/<pid>-<start>.json and the
+        /metrics endpoint sums the snapshots of all workers. Snapshots of
+        workers that have exited are folded into <dir>/archive.json so counters
+        survive worker recycling. <start> is taken on a process's first flush,
+        so forked workers never write to their parent's snapshot and a reused
+        pid gets a new file.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._snapshot_pid = None
+        self._snapshot_name = None
+        self._discarded_pid = None
+        self._last_flush = 0.0
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError('Metric %s is already registered.' % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    @property
+    def multiprocess_dir(self):
+        directory = getattr(settings, 'METRICS_MULTIPROCESS_DIR', None)
+        return Path(directory) if directory else None
+
+    def _snapshot_path(self, directory):
+        pid = os.getpid()
+        if self._snapshot_pid != pid:
+            self._snapshot_pid = pid
+            self._snapshot_name = '%d-%d.json' % (pid, time.time() * 1000)
+        return directory / self._snapshot_name
+
+    def flush(self):
+        """
+            Writes this worker's snapshot to the multi-process directory, if any.
+        """
+        directory = self.multiprocess_dir
+        if directory is None or self._discarded_pid == os.getpid():
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        path = self._snapshot_path(directory)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.snapshot()))
+        tmp_path.replace(path)
+        self._last_flush = time.monotonic()
+
+    def discard(self):
+        """
+            Stops the current process writing snapshots and removes the one it
+            wrote, e.g. in the gunicorn master, which serves no requests.
+            Processes forked from it afterwards flush as usual.
+        """
+        self._discarded_pid = os.getpid()
+        directory = self.multiprocess_dir
+        if directory is not None and self._snapshot_pid == self._discarded_pid:
+            self._snapshot_path(directory).unlink(missing_ok=True)
+
+    def maybe_flush(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5.0)
+        if self.multiprocess_dir is not None and time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def _merge(self, snapshot, totals):
+        for name, samples in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is not None:
+                metric.merge(samples, totals.setdefault(name, {}))
+
+    def collect(self):
+        """
+            Returns the samples of every metric, summed across workers.
+        """
+        directory = self.multiprocess_dir
+        if directory is None:
+            return self.snapshot()
+        self.flush()
+        with ExitStack() as stack:
+            if fcntl is not None:
+                lock_file = stack.enter_context(open(directory / '.lock', 'w'))
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            archive_path = directory / 'archive.json'
+            archive = json.loads(archive_path.read_text()) if archive_path.exists() else {}
+            totals = {}
+            self._merge(archive, totals)
+            dead = []
+            for path in directory.glob('*-*.json'):
+                try:
+                    snapshot = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+                self._merge(snapshot, totals)
+                if not _pid_alive(int(path.name.split('-', 1)[0])):
+                    dead.append(path)
+            if dead:
+                archived = {}
+                self._merge(archive, archived)
+                for path in dead:
+                    self._merge(json.loads(path.read_text()), archived)
+                archive_path.write_text(json.dumps(archived))
+                for path in dead:
+                    path.unlink()
+        return totals
+
+    def render(self):
+        """
+            Renders all metrics in the Prometheus text exposition format.
+        """
+        samples = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append('# HELP %s %s' % (name, metric.documentation))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            lines.extend(metric.render(samples.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by view, method and status.', ('view', 'method', 'status'))
+REQUEST_QUERIES = registry.histogram(
+    'http_request_db_queries', 'Database queries executed per request by view.', ('view',),
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+GEOCODER_REQUESTS = registry.counter(
+    'geocoder_requests_total', 'Geocoder calls by outcome (found, not_found, error).', ('outcome',))
+GEOCODER_LATENCY = registry.histogram(
+    'geocoder_request_duration_seconds', 'Geocoder call latency.')
+BUSINESS_ROWS_SCANNED = registry.counter(
+    'business_rows_scanned_total', 'Business rows read by filter_by_distance.')
+RATELIMIT_REJECTIONS = registry.counter(
+    'ratelimit_rejections_total', 'Requests rejected by rate limits, by scope.', ('scope',))
+USER_ACTIVITY_FLUSHED = registry.counter(
+    'user_activity_flushed_total', 'User activity timestamps written by batched flushes.')
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """
+        Records latency and database query count for every request, for
+        streamed responses once their body has been sent.
+
+        Disabled, and removed from the middleware stack, when
+        settings.METRICS_ENABLED is false.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+        # Shard queries run from pool threads are counted too, see mbapp.db.execute_wrapper.
+        lock = threading.Lock()
+
+        def count_query(execute, sql, params, many, context):
+            with lock:
+                queries[0] += 1
+            return execute(sql, params, many, context)
+
+        def counting():
+            return execute_wrapper(count_query)
+
+        def record():
+            duration = time.perf_counter() - started
+            view = _view_name(request)
+            REQUEST_LATENCY.observe(duration, (view, request.method, response.status_code))
+            REQUEST_QUERIES.observe(queries[0], (view,))
+            registry.maybe_flush()
+
+        started = time.perf_counter()
+        with counting():
+            response = self.get_response(request)
+        if response.streaming:
+            ObservedStream.wrap(response, counting, record)
+        else:
+            record()
+        return response
+
+
+def metrics_allowed(request):
+    """
+        Tells whether a request may read the metrics: it comes from an address in
+        settings.METRICS_ALLOWED_IPS or carries settings.METRICS_TOKEN as bearer token.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in getattr(settings, 'METRICS_ALLOWED_IPS', ()))
+
+
+def metrics_view(request):
+    """
+        Exposes the metrics registry in the Prometheus text format to the clients allowed by metrics_allowed().
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
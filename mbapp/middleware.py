@@ -0,0 +1,227 @@
+import logging
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.urls import NoReverseMatch, reverse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class ObservedStream:
+    """
+        Extends a middleware's measurement of a streamed response to its body.
+
+        The body of a StreamingHttpResponse is produced while the server sends
+        it, after every middleware has returned. The stream enters the context
+        manager returned by `around()` while each chunk is produced, and calls
+        `on_close()` once, when the body has been sent or the response closed.
+
+        Usage:
+            if response.streaming:
+                ObservedStream.wrap(response, lambda: counter, lambda: self.report(counter))
+            else:
+                self.report(counter)
+    """
+
+    def __init__(self, chunks, around, on_close):
+        self._chunks = iter(chunks)
+        self._around = around
+        self._on_close = on_close
+        self._closed = False
+
+    @classmethod
+    def wrap(cls, response, around, on_close):
+        response.streaming_content = cls(response.streaming_content, around, on_close)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            with self._around():
+                return next(self._chunks)
+        except BaseException:
+            # StopIteration included: the body is complete.
+            self.close()
+            raise
+
+    def close(self):
+        # Called by the server through StreamingHttpResponse.close(), even if the body was never read.
+        if not self._closed:
+            self._closed = True
+            self._on_close()
+
+
+class MiddlewareStack:
+    """
+        A chain of middleware built the same way Django's BaseHandler builds
+        settings.MIDDLEWARE, including the process_view, process_template_response
+        and process_exception hooks of every middleware in the chain.
+    """
+
+    def __init__(self, middleware_paths, get_response):
+        self.view_middleware = []
+        self.template_response_middleware = []
+        self.exception_middleware = []
+
+        handler = convert_exception_to_response(get_response)
+        for middleware_path in reversed(middleware_paths):
+            middleware = import_string(middleware_path)
+            try:
+                mw_instance = middleware(handler)
+            except MiddlewareNotUsed:
+                logger.debug("MiddlewareNotUsed: %r", middleware_path)
+                continue
+            if mw_instance is None:
+                raise ImproperlyConfigured("Middleware factory %s returned None." % middleware_path)
+
+            if hasattr(mw_instance, 'process_view'):
+                self.view_middleware.insert(0, mw_instance.process_view)
+            if hasattr(mw_instance, 'process_template_response'):
+                self.template_response_middleware.append(mw_instance.process_template_response)
+            if hasattr(mw_instance, 'process_exception'):
+                self.exception_middleware.append(mw_instance.process_exception)
+            handler = convert_exception_to_response(mw_instance)
+        self.handler = handler
+
+
+class RouteMiddlewareDispatcher:
+    """
+        Runs settings.SESSION_MIDDLEWARE only for routes that need it.
+
+        Requests whose path starts with one of settings.API_PATH_PREFIXES are
+        stateless JWT API calls: they skip session loading, CSRF, messages and
+        clickjacking protection and go straight to the view. Every other route
+        (admin, the HTML index, the API docs) runs the full session stack.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        self.api_prefixes = tuple(getattr(settings, 'API_PATH_PREFIXES', ()))
+        self.api_stack = MiddlewareStack([], get_response)
+        self.session_stack = MiddlewareStack(getattr(settings, 'SESSION_MIDDLEWARE', []), get_response)
+
+    def get_stack(self, request):
+        if request.path_info.startswith(self.api_prefixes):
+            return self.api_stack
+        return self.session_stack
+
+    def __call__(self, request):
+        return self.get_stack(request).handler(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for method in self.get_stack(request).view_middleware:
+            response = method(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        for method in self.get_stack(request).template_response_middleware:
+            response = method(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        for method in self.get_stack(request).exception_middleware:
+            response = method(request, exception)
+            if response is not None:
+                return response
+        return None
+
+
+DISPATCHER = 'mbapp.middleware.RouteMiddlewareDispatcher'
+CSRF_MIDDLEWARE = 'django.middleware.csrf.CsrfViewMiddleware'
+XFRAME_MIDDLEWARE = 'django.middleware.clickjacking.XFrameOptionsMiddleware'
+ADMIN_MIDDLEWARE = (
+    ('mbapp.E001', 'django.contrib.auth.middleware.AuthenticationMiddleware'),
+    ('mbapp.E002', 'django.contrib.messages.middleware.MessageMiddleware'),
+    ('mbapp.E003', 'django.contrib.sessions.middleware.SessionMiddleware'),
+)
+
+
+def _contains(middleware_paths, middleware_path):
+    middleware_class = import_string(middleware_path)
+    return any(issubclass(import_string(path), middleware_class) for path in middleware_paths)
+
+
+def _dispatched_middleware():
+    # SESSION_MIDDLEWARE, when RouteMiddlewareDispatcher runs it.
+    if not _contains(settings.MIDDLEWARE, DISPATCHER):
+        return []
+    return list(getattr(settings, 'SESSION_MIDDLEWARE', []))
+
+
+def check_session_middleware(app_configs, **kwargs):
+    """
+        System check standing in for admin.E408, admin.E409 and admin.E410.
+
+        Those require the auth, messages and session middleware in MIDDLEWARE,
+        while RouteMiddlewareDispatcher runs them from SESSION_MIDDLEWARE.
+        They are silenced in the settings, so this checks the admin still gets
+        them: directly from MIDDLEWARE, or through the dispatcher on a route
+        outside API_PATH_PREFIXES.
+    """
+    dispatched = _contains(settings.MIDDLEWARE, DISPATCHER)
+    session_middleware = _dispatched_middleware()
+    errors = []
+    for check_id, middleware_path in ADMIN_MIDDLEWARE:
+        if not _contains(settings.MIDDLEWARE, middleware_path) and not _contains(session_middleware, middleware_path):
+            errors.append(checks.Error(
+                "'%s' must be in MIDDLEWARE, or in SESSION_MIDDLEWARE with "
+                "'mbapp.middleware.RouteMiddlewareDispatcher' in MIDDLEWARE, "
+                "in order to use the admin application." % middleware_path,
+                id=check_id,
+            ))
+    try:
+        admin_path = reverse('admin:index')
+    except NoReverseMatch:
+        return errors
+    if dispatched and admin_path.startswith(tuple(getattr(settings, 'API_PATH_PREFIXES', ()))):
+        errors.append(checks.Error(
+            "The admin at %s is in API_PATH_PREFIXES and so runs without SESSION_MIDDLEWARE." % admin_path,
+            id='mbapp.E004',
+        ))
+    return errors
+
+
+def check_session_security(app_configs, **kwargs):
+    """
+        Deployment check standing in for security.W002 and security.W003.
+
+        Those require the clickjacking and CSRF middleware in MIDDLEWARE, and
+        Django skips the checks of their settings, security.W016 and
+        security.W019, without them there. With the middleware run from
+        SESSION_MIDDLEWARE instead, this reports the same problems.
+    """
+    dispatched = _dispatched_middleware()
+    warnings = []
+    # Middleware in MIDDLEWARE is covered by Django's own checks.
+    if not _contains(settings.MIDDLEWARE, CSRF_MIDDLEWARE):
+        if not _contains(dispatched, CSRF_MIDDLEWARE):
+            warnings.append(checks.Warning(
+                "'%s' is in neither MIDDLEWARE nor the dispatched SESSION_MIDDLEWARE, so session "
+                "authenticated pages are not protected against cross-site request forgery." % CSRF_MIDDLEWARE,
+                id='mbapp.W003',
+            ))
+        elif not settings.CSRF_USE_SESSIONS and settings.CSRF_COOKIE_SECURE is not True:
+            warnings.append(checks.Warning(
+                "'%s' is in SESSION_MIDDLEWARE, but CSRF_COOKIE_SECURE is not set to True." % CSRF_MIDDLEWARE,
+                id='mbapp.W016',
+            ))
+    if not _contains(settings.MIDDLEWARE, XFRAME_MIDDLEWARE):
+        if not _contains(dispatched, XFRAME_MIDDLEWARE):
+            warnings.append(checks.Warning(
+                "'%s' is in neither MIDDLEWARE nor the dispatched SESSION_MIDDLEWARE, so pages are "
+                "served without an X-Frame-Options header." % XFRAME_MIDDLEWARE,
+                id='mbapp.W002',
+            ))
+        elif settings.X_FRAME_OPTIONS != 'DENY':
+            warnings.append(checks.Warning(
+                "'%s' is in SESSION_MIDDLEWARE, but X_FRAME_OPTIONS is not set to 'DENY'." % XFRAME_MIDDLEWARE,
+                id='mbapp.W019',
+            ))
+    return warnings
@@ -0,0 +1,226 @@
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from mbapp.db import execute_wrapper
+from mbapp.middleware import ObservedStream
+from mbapp.tracing import current_trace
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudget:
+    """
+        Upper bounds on the queries a view may run and the rows it may fetch
+        while handling one request. None means unbounded.
+    """
+
+    def __init__(self, max_queries=None, max_rows=None):
+        self.max_queries = max_queries
+        self.max_rows = max_rows
+
+    def violations(self, counter):
+        violations = []
+        if self.max_queries is not None and counter.queries > self.max_queries:
+            violations.append('%d queries (budget %d)' % (counter.queries, self.max_queries))
+        if self.max_rows is not None and counter.rows > self.max_rows:
+            violations.append('%d rows fetched (budget %d)' % (counter.rows, self.max_rows))
+        return violations
+
+
+def query_budget(max_queries=None, max_rows=None):
+    """
+        Declares the query budget of a view class or view function.
+
+        Usage:
+            @query_budget(max_queries=2)
+            class BusinessList(APIView):
+                ...
+    """
+    def decorator(view):
+        view.query_budget = QueryBudget(max_queries, max_rows)
+        return view
+    return decorator
+
+
+def get_query_budget(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+class _RowCountingCursor:
+    """
+        Proxy around a DB-API cursor counting the rows returned by fetch calls.
+    """
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._counter.count_rows(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._counter.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._counter.count_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._counter.count_rows(1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class QueryCounter:
+    """
+        Counts the queries executed and rows fetched on every database
+        connection while active, and how often each SQL statement ran on
+        each of them. Queries run from pool threads through
+        businesses.sharding.fan_out are counted too.
+
+        Usage:
+            with QueryCounter() as counter:
+                ...
+            counter.queries, counter.rows, counter.repeated()
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.statements = Counter()
+        self._lock = threading.Lock()
+        self._active = None
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.queries += 1
+            self.statements[context['connection'].alias, sql] += 1
+        cursor_wrapper = context['cursor']
+        if not isinstance(cursor_wrapper.cursor, _RowCountingCursor):
+            cursor_wrapper.cursor = _RowCountingCursor(cursor_wrapper.cursor, self)
+        return execute(sql, params, many, context)
+
+    def count_rows(self, rows):
+        with self._lock:
+            self.rows += rows
+
+    def __enter__(self):
+        self._active = execute_wrapper(self)
+        self._active.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._active.__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def repeated(self, threshold=None):
+        """
+            Returns the statements executed at least `threshold` times on one
+            database, the usual sign of an N+1 query pattern, as a {sql: count}
+            dict. The same query sent once to every shard is not repeated.
+        """
+        if threshold is None:
+            threshold = getattr(settings, 'QUERY_BUDGET_REPEAT_THRESHOLD', 3)
+        repeated = {}
+        for (alias, sql), count in self.statements.items():
+            if count >= threshold:
+                repeated[sql] = max(count, repeated.get(sql, 0))
+        return repeated
+
+
+def _describe(counter, violations, repeated):
+    lines = violations + ['%dx %s' % (count, sql) for sql, count in repeated.items()]
+    return '; '.join(lines)
+
+
+@contextmanager
+def assert_query_budget(max_queries=None, max_rows=None, allow_repeated=False):
+    """
+        Test helper failing when the wrapped block exceeds a query budget.
+
+        Usage:
+            with assert_query_budget(max_queries=2, max_rows=50):
+                self.client.get('/businesses/?location=Dhaka')
+
+        Raises:
+            AssertionError: If the budget is exceeded or, unless allow_repeated
+            is set, if a statement was repeated often enough to look like N+1.
+    """
+    with QueryCounter() as counter:
+        yield counter
+    violations = QueryBudget(max_queries, max_rows).violations(counter)
+    repeated = {} if allow_repeated else counter.repeated()
+    if violations or repeated:
+        raise AssertionError('Query budget exceeded: %s' % _describe(counter, violations, repeated))
+
+
+class QueryBudgetMiddleware:
+    """
+        Enforces the query budgets declared with @query_budget.
+
+        Every request is counted; requests exceeding their view's budget or
+        repeating a statement QUERY_BUDGET_REPEAT_THRESHOLD times are logged,
+        or raise QueryBudgetExceeded when QUERY_BUDGET_RAISE is set. Streamed
+        responses are counted until their body has been sent. When a request
+        trace is active the counts are added to it: to the Server-Timing header,
+        or for streamed responses to its log record only, as the header goes
+        out before the body. Disabled unless settings.QUERY_BUDGET_ENABLED is set.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.raise_on_violation = getattr(settings, 'QUERY_BUDGET_RAISE', False)
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with counter:
+            response = self.get_response(request)
+        trace = current_trace()
+        if response.streaming:
+            ObservedStream.wrap(response, lambda: counter, lambda: self.check(request, counter, trace))
+        else:
+            self.check(request, counter, trace)
+        return response
+
+    def check(self, request, counter, trace):
+        if trace is not None:
+            trace.annotate('db-queries', counter.queries)
+            trace.annotate('db-rows', counter.rows)
+
+        match = getattr(request, 'resolver_match', None)
+        budget = get_query_budget(match.func) if match is not None else None
+        violations = budget.violations(counter) if budget is not None else []
+        repeated = counter.repeated()
+        if violations or repeated:
+            message = '%s %s: %s' % (request.method, request.path, _describe(counter, violations, repeated))
+            if self.raise_on_violation:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={
+                'path': request.path,
+                'queries': counter.queries,
+                'rows': counter.rows,
+                'repeated': repeated,
+            })
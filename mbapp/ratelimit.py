@@ -0,0 +1,272 @@
+import ipaddress
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import JsonResponse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from mbapp.metrics import RATELIMIT_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+        Parses a rate such as '10/m' or '1000/hour'.
+
+        Returns:
+            tuple: (requests, period in seconds). The bucket holds `requests`
+            tokens and refills completely over the period.
+    """
+    try:
+        requests, period = rate.split('/')
+        return int(requests), RATE_PERIODS[period[0]]
+    except (ValueError, KeyError, IndexError):
+        raise ImproperlyConfigured('Invalid rate %r, expected "<requests>/<s|m|h|d>".' % rate)
+
+
+def is_trusted_proxy(address):
+    """
+        Tells whether an address is in settings.RATELIMIT_TRUSTED_PROXIES, a list of addresses or networks.
+    """
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(proxy, strict=False)
+               for proxy in getattr(settings, 'RATELIMIT_TRUSTED_PROXIES', ()))
+
+
+def client_ip(request):
+    """
+        Returns the client address.
+
+        settings.RATELIMIT_CLIENT_IP_HEADER is only read when the request comes
+        from a trusted proxy, otherwise any client could pick its own address.
+        The header is read from the right, each proxy appending the address it
+        saw, and the first address that is not a trusted proxy is the client:
+        the addresses left of it are sent by the client and cannot be trusted.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR', '')
+    header = getattr(settings, 'RATELIMIT_CLIENT_IP_HEADER', '')
+    if not header or not request.META.get(header) or not is_trusted_proxy(remote_addr):
+        return remote_addr
+    hops = [hop.strip() for hop in request.META[header].split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else remote_addr
+
+
+def token_user_id(request):
+    """
+        Returns the user id of the request's JWT access token, or None.
+
+        Only the token's signature and expiry are checked, which needs no
+        database query, so the id is known before authentication runs.
+    """
+    scheme, _, raw_token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme not in jwt_settings.AUTH_HEADER_TYPES or not raw_token:
+        return None
+    try:
+        return AccessToken(raw_token.strip()).get(jwt_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+def user_or_ip(request):
+    user_id = token_user_id(request)
+    if user_id is not None:
+        return 'user:%s' % user_id
+    return 'ip:%s' % client_ip(request)
+
+
+KEY_FUNCTIONS = {
+    'ip': lambda request: 'ip:%s' % client_ip(request),
+    'user': user_or_ip,
+}
+
+
+class RateLimit:
+    def __init__(self, scope, key, methods, condition=None):
+        self.scope = scope
+        self.key = KEY_FUNCTIONS[key] if isinstance(key, str) else key
+        self.methods = {method.upper() for method in methods} if methods else None
+        self.condition = condition
+
+    def applies_to(self, request):
+        if self.methods is not None and request.method not in self.methods:
+            return False
+        return self.condition is None or self.condition(request)
+
+    def bucket_key(self, request):
+        return 'ratelimit:%s:%s' % (self.scope, self.key(request))
+
+
+def rate_limit(scope, key='user', methods=None, condition=None):
+    """
+        Declares a token bucket rate limit on a view class or view function.
+
+        The rate of every scope is set in settings.RATELIMIT_RATES; a scope
+        without a rate is not limited. Views sharing a scope share buckets.
+
+        Usage:
+            @rate_limit('auth', key='ip')
+            class SignInView(APIView):
+                ...
+
+        Args:
+            scope (str): Name of the limit in settings.RATELIMIT_RATES.
+            key (str): 'ip' for a bucket per client address, 'user' for a bucket
+                per authenticated user and per address for anonymous requests,
+                or a callable returning the bucket of a request.
+            methods (list): HTTP methods limited, all of them by default.
+            condition (callable): Takes the request and returns whether it is
+                limited, all requests by default.
+    """
+    def decorator(view):
+        view.rate_limits = getattr(view, 'rate_limits', ()) + (RateLimit(scope, key, methods, condition),)
+        return view
+    return decorator
+
+
+def get_rate_limits(view_func):
+    limits = getattr(view_func, 'rate_limits', None)
+    if limits is None:
+        limits = getattr(getattr(view_func, 'view_class', None), 'rate_limits', ())
+    return limits
+
+
+class CacheTokenBuckets:
+    """
+        Token buckets stored in a Django cache.
+
+        Updates are serialized with a process-local lock, which makes them
+        atomic with the per-process LocMemCache. With a cache shared between
+        processes, concurrent requests may occasionally both take the last token.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate):
+        """
+            Takes a token from a bucket.
+
+            Returns:
+                float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        with self._lock:
+            now = time.time()
+            tokens, updated = self.cache.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / refill_rate
+            if not wait:
+                tokens -= 1
+            self.cache.set(key, (tokens, now), timeout=math.ceil(capacity / refill_rate) + 1)
+        return wait
+
+
+class RedisTokenBuckets:
+    """
+        Token buckets stored in Redis and updated atomically by a Lua script.
+
+        The script reads the clock of the Redis server, so buckets shared by
+        several application servers do not depend on their clocks agreeing.
+    """
+    SCRIPT = """
+        local capacity = tonumber(ARGV[1])
+        local refill_rate = tonumber(ARGV[2])
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / refill_rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        return tostring(wait)
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._script = None
+
+    def consume(self, key, capacity, refill_rate):
+        key = self.cache.make_key(key)
+        client = self.cache._cache.get_client(key, write=True)
+        if self._script is None:
+            self._script = client.register_script(self.SCRIPT)
+        ttl = math.ceil(capacity / refill_rate) + 1
+        return float(self._script(keys=[key], args=[capacity, refill_rate, ttl], client=client))
+
+
+def get_token_buckets():
+    cache = caches[getattr(settings, 'RATELIMIT_CACHE', 'default')]
+    if isinstance(cache, RedisCache):
+        return RedisTokenBuckets(cache)
+    return CacheTokenBuckets(cache)
+
+
+def throttled_response(wait):
+    seconds = max(1, math.ceil(wait))
+    response = JsonResponse(
+        {'detail': 'Request was throttled. Expected available in %d seconds.' % seconds}, status=429)
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+class RateLimitMiddleware:
+    """
+        Enforces the rate limits declared with @rate_limit.
+
+        Limits are checked in process_view, after URL resolution but before the
+        view is called, so a throttled request is rejected before DRF
+        authentication, password hashing or geocoding, at the cost of a single
+        round trip to the bucket store. Rejections are answered with 429 and a
+        Retry-After header. If the store is unavailable requests are let through.
+        Disabled unless settings.RATELIMIT_ENABLED is set.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'RATELIMIT_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.rates = {scope: parse_rate(rate) for scope, rate in getattr(settings, 'RATELIMIT_RATES', {}).items()}
+        self.buckets = get_token_buckets()
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for limit in get_rate_limits(view_func):
+            rate = self.rates.get(limit.scope)
+            if rate is None or not limit.applies_to(request):
+                continue
+            capacity, period = rate
+            try:
+                wait = self.buckets.consume(limit.bucket_key(request), capacity, capacity / period)
+            except Exception:
+                logger.warning('Rate limit store unavailable, %s not limited.', limit.scope, exc_info=True)
+                continue
+            if wait:
+                RATELIMIT_REJECTIONS.inc(labels=(limit.scope,))
+                return throttled_response(wait)
+        return None
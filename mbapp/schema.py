@@ -0,0 +1,213 @@
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+
+from mbapp.streaming import negotiate_encoding
+
+logger = logging.getLogger(__name__)
+
+RENDERERS = {
+    'yaml': OpenApiYamlRenderer,
+    'json': OpenApiJsonRenderer,
+}
+VERSIONED_PACKAGES = ('Django', 'djangorestframework', 'djangorestframework-simplejwt', 'drf-spectacular')
+# Temporary files of other code versions younger than this may still be renamed into place by their writer.
+STALE_TMP_SECONDS = 3600
+
+_lock = threading.Lock()
+_compiled = None
+
+
+def code_version_hash():
+    """
+        Computes a hash identifying the code the schema is generated from.
+
+        The hash covers every Python source file of the project's own apps, the
+        versions of the packages taking part in schema generation and the
+        SPECTACULAR_SETTINGS, so any change that can alter the schema changes it.
+
+        Returns:
+            str: A short hex digest.
+    """
+    digest = hashlib.sha256()
+    base_dir = Path(settings.BASE_DIR).resolve()
+    app_paths = sorted({Path(config.path).resolve() for config in apps.get_app_configs()})
+    for app_path in app_paths:
+        if base_dir not in app_path.parents:
+            continue
+        for source in sorted(app_path.rglob('*.py')):
+            digest.update(str(source.relative_to(base_dir)).encode())
+            digest.update(source.read_bytes())
+    for package in VERSIONED_PACKAGES:
+        try:
+            digest.update(('%s==%s' % (package, version(package))).encode())
+        except PackageNotFoundError:
+            pass
+    digest.update(repr(sorted(getattr(settings, 'SPECTACULAR_SETTINGS', {}).items())).encode())
+    return digest.hexdigest()[:16]
+
+
+class CompiledSchema:
+    """
+        The rendered OpenAPI document in every served format, plain and gzipped.
+    """
+
+    def __init__(self, code_hash, documents):
+        self.code_hash = code_hash
+        self.documents = documents
+
+    def get(self, fmt, compressed):
+        return self.documents[fmt]['gzip' if compressed else 'plain']
+
+    def etag(self, fmt, compressed):
+        # Each representation gets its own validator, as required for strong ETags.
+        return '"%s-%s%s"' % (self.code_hash, fmt, '-gzip' if compressed else '')
+
+
+def _none_match(if_none_match, etag):
+    # If-None-Match lists validators, or is "*", and compares them weakly.
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in [tag.removeprefix('W/') for tag in etags]
+
+
+def _schema_path(cache_dir, code_hash, fmt, compressed=False):
+    return Path(cache_dir) / ('openapi-%s.%s%s' % (code_hash, fmt, '.gz' if compressed else ''))
+
+
+def generate_documents():
+    """
+        Generates the OpenAPI schema once and renders it in every served format.
+
+        Returns:
+            dict: Rendered bytes keyed by format name.
+    """
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(urlconf=spectacular_settings.SERVE_URLCONF)
+    data = generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+    return {
+        fmt: renderer().render(data, renderer.media_type, renderer_context={})
+        for fmt, renderer in RENDERERS.items()
+    }
+
+
+def _write_atomic(path, payload):
+    # Every writer renames its own temporary file into place, so concurrent
+    # compilations never read a partial file or remove each other's.
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name + '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp_file:
+        tmp_file.write(payload)
+    os.replace(tmp_name, path)
+
+
+def _read_documents(cache_dir, code_hash):
+    return {
+        fmt: {
+            'plain': _schema_path(cache_dir, code_hash, fmt).read_bytes(),
+            'gzip': _schema_path(cache_dir, code_hash, fmt, True).read_bytes(),
+        }
+        for fmt in RENDERERS
+    }
+
+
+def _remove_stale(cache_dir, code_hash):
+    current = 'openapi-%s.' % code_hash
+    for path in cache_dir.glob('openapi-*'):
+        if path.name.startswith(current):
+            continue
+        try:
+            if path.suffix == '.tmp' and time.time() - path.stat().st_mtime < STALE_TMP_SECONDS:
+                continue
+            path.unlink()
+        except FileNotFoundError:
+            # Removed by another process compiling at the same time.
+            pass
+
+
+def compile_schema(force=False):
+    """
+        Loads the schema for the current code version, generating it if needed.
+
+        Schema files are written to settings.SCHEMA_CACHE_DIR as
+        openapi-<hash>.<format> with a precompressed .gz sibling. Once they are
+        written, the files of other code versions are removed. Several processes
+        may compile at the same time, e.g. workers of a new release starting.
+
+        Args:
+            force (bool): Regenerate even if files for the current hash exist.
+
+        Returns:
+            CompiledSchema: The compiled schema for the current code version.
+    """
+    cache_dir = Path(settings.SCHEMA_CACHE_DIR)
+    code_hash = code_version_hash()
+    if not force:
+        try:
+            return CompiledSchema(code_hash, _read_documents(cache_dir, code_hash))
+        except FileNotFoundError:
+            pass
+
+    logger.info("Compiling OpenAPI schema for code version %s", code_hash)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    documents = {}
+    for fmt, content in generate_documents().items():
+        documents[fmt] = {'plain': content, 'gzip': gzip.compress(content, compresslevel=9, mtime=0)}
+        _write_atomic(_schema_path(cache_dir, code_hash, fmt), documents[fmt]['plain'])
+        _write_atomic(_schema_path(cache_dir, code_hash, fmt, True), documents[fmt]['gzip'])
+    _remove_stale(cache_dir, code_hash)
+    return CompiledSchema(code_hash, documents)
+
+
+def get_compiled_schema():
+    """
+        Returns the process-wide compiled schema, compiling it on first use.
+    """
+    global _compiled
+    if _compiled is None:
+        with _lock:
+            if _compiled is None:
+                _compiled = compile_schema()
+    return _compiled
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """
+        Serves the precompiled OpenAPI schema instead of regenerating it per request.
+
+        The format is still chosen by content negotiation (YAML or JSON). The
+        response carries an ETag derived from the code version hash, answers
+        If-None-Match with 304 and is sent gzipped when the client accepts it.
+    """
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        schema = get_compiled_schema()
+        renderer = request.accepted_renderer
+        fmt = 'json' if renderer.format == 'json' else 'yaml'
+        compressed = negotiate_encoding(request.headers.get('Accept-Encoding', ''), ('gzip',)) == 'gzip'
+        etag = schema.etag(fmt, compressed)
+
+        if _none_match(request.headers.get('If-None-Match', ''), etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(schema.get(fmt, compressed), content_type=renderer.media_type)
+            if compressed:
+                response['Content-Encoding'] = 'gzip'
+            response['Content-Disposition'] = 'inline; filename="%s.%s"' % (spectacular_settings.TITLE or 'schema', fmt)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        return response
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from datetime import timedelta
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,25 +45,92 @@ INSTALLED_APPS = [
     "corsheaders",
     "drf_spectacular",
     # Created apps
+    "mbapp",
     "user",
     "businesses",
 ]
 AUTH_USER_MODEL = 'user.User'
 
 MIDDLEWARE = [
+    "mbapp.metrics.MetricsMiddleware",
+    "mbapp.tracing.TracingMiddleware",
+    "mbapp.querybudget.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.security.SecurityMiddleware",
+    "mbapp.ratelimit.RateLimitMiddleware",
+    "mbapp.middleware.RouteMiddlewareDispatcher",
+]
+
+# Run by RouteMiddlewareDispatcher for every route except the stateless JWT API prefixes below
+SESSION_MIDDLEWARE = [
     "django.contrib.sessions.middleware.SessionMiddleware",
-    "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+API_PATH_PREFIXES = (
+    "/businesses/",
+    "/user/api/",
+    "/api/token/",
+    "/metrics",
+)
+
+# Per-request phase timings in Server-Timing headers and mbapp.tracing log records
+TRACING_ENABLED = config('TRACING_ENABLED', default=DEBUG, cast=bool)
+
+# Token bucket rate limits declared on views with mbapp.ratelimit.rate_limit, as "<requests>/<s|m|h|d>"
+# per scope. Buckets live in the RATELIMIT_CACHE cache, updated atomically by a Lua script on Redis.
+RATELIMIT_ENABLED = config('RATELIMIT_ENABLED', default=True, cast=bool)
+RATELIMIT_CACHE = "default"
+RATELIMIT_RATES = {
+    "geocode": config('RATELIMIT_GEOCODE', default="60/m"),
+    "auth": config('RATELIMIT_AUTH', default="10/m"),
+    "password_reset": config('RATELIMIT_PASSWORD_RESET', default="5/h"),
+}
+# Request header carrying the client address when behind a reverse proxy, e.g. HTTP_X_REAL_IP. It is
+# only read on requests from RATELIMIT_TRUSTED_PROXIES, addresses or networks such as 172.16.0.0/12.
+RATELIMIT_CLIENT_IP_HEADER = config('RATELIMIT_CLIENT_IP_HEADER', default="")
+RATELIMIT_TRUSTED_PROXIES = config('RATELIMIT_TRUSTED_PROXIES', default="", cast=Csv())
+
+# Per-view query budgets declared with mbapp.querybudget.query_budget. Violations and statements
+# repeated QUERY_BUDGET_REPEAT_THRESHOLD times (N+1) are logged, or raised with QUERY_BUDGET_RAISE.
+QUERY_BUDGET_ENABLED = config('QUERY_BUDGET_ENABLED', default=DEBUG, cast=bool)
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=False, cast=bool)
+QUERY_BUDGET_REPEAT_THRESHOLD = 3
+
+# Prometheus metrics exposed at /metrics, see mbapp.metrics. Set METRICS_MULTIPROCESS_DIR
+# to a directory shared by all workers to aggregate metrics across processes; gunicorn.conf.py
+# sets one for every gunicorn server.
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_MULTIPROCESS_DIR = config('METRICS_MULTIPROCESS_DIR', default=None)
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+# /metrics answers clients in METRICS_ALLOWED_IPS (addresses or networks) or sending the bearer token
+# METRICS_TOKEN. nginx does not serve it publicly, scrapers reach the application port directly.
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default="127.0.0.1,::1", cast=Csv())
+METRICS_TOKEN = config('METRICS_TOKEN', default="")
+
+# Sign-ins and requests are buffered per process by user.activity and written to last_login and
+# last_seen every ACTIVITY_FLUSH_INTERVAL seconds, the most the stored timestamps lag behind.
+# 0 starts no background writer, leaving only the flushes at worker or process exit.
+ACTIVITY_FLUSH_INTERVAL = config('ACTIVITY_FLUSH_INTERVAL', default=10.0, cast=float)
+ACTIVITY_FLUSH_BATCH_SIZE = 500
+
+# Cold start budget checked by `manage.py startup_profile`, measured at ~780ms
+STARTUP_BUDGET_MS = config('STARTUP_BUDGET_MS', default=1000, cast=float)
+
+# The admin requires the auth (admin.E408), messages (admin.E409) and session (admin.E410) middleware in
+# MIDDLEWARE. They live in SESSION_MIDDLEWARE instead, which RouteMiddlewareDispatcher runs for the admin
+# like every route outside API_PATH_PREFIXES. mbapp.middleware.check_session_middleware (mbapp.E001-E004)
+# reports the same misconfigurations for this layout, so these three are safe to silence.
+# Likewise `check --deploy` wants the CSRF (security.W003) and clickjacking (security.W002) middleware
+# in MIDDLEWARE, and skips the checks of CSRF_COOKIE_SECURE and X_FRAME_OPTIONS without them there.
+# mbapp.middleware.check_session_security (mbapp.W002, W003, W016, W019) checks them in SESSION_MIDDLEWARE.
+SILENCED_SYSTEM_CHECKS = ["admin.E408", "admin.E409", "admin.E410", "security.W002", "security.W003"]
+
 ROOT_URLCONF = "mbapp.urls"
 
 TEMPLATES = [
@@ -89,11 +156,72 @@ WSGI_APPLICATION = "mbapp.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Switch to PostgreSQL with DB_ENGINE=django.db.backends.postgresql and the DB_* variables below.
+DB_ENGINE = config('DB_ENGINE', default="django.db.backends.sqlite3")
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "ENGINE": DB_ENGINE,
+        "NAME": config('DB_NAME', default=BASE_DIR / "db.sqlite3"),
+        "USER": config('DB_USER', default=""),
+        "PASSWORD": config('DB_PASSWORD', default=""),
+        "HOST": config('DB_HOST', default=""),
+        "PORT": config('DB_PORT', default=""),
+        # Persistent connections, reused across requests for up to CONN_MAX_AGE seconds
+        "CONN_MAX_AGE": config('DB_CONN_MAX_AGE', default=600, cast=int),
+        "CONN_HEALTH_CHECKS": True,
+    }
+}
+
+# Comma separated read replicas: database files for SQLite, hosts otherwise. Each becomes a
+# "replica_<n>" alias that mbapp.db.ReadWriteRouter sends reads to.
+for index, replica in enumerate(config('DB_REPLICAS', default="", cast=Csv())):
+    DATABASES["replica_%d" % index] = dict(
+        DATABASES["default"],
+        **{"NAME" if DB_ENGINE.endswith("sqlite3") else "HOST": replica},
+        TEST={"MIRROR": "default"},
+    )
+
+# Comma separated business shards, database files for SQLite, hosts otherwise. Each becomes a
+# "shard_<n>" alias storing the businesses of the spatial cells assigned to it, see businesses.sharding.
+for index, shard in enumerate(config('DB_SHARDS', default="", cast=Csv())):
+    DATABASES["shard_%d" % index] = dict(
+        DATABASES["default"],
+        **{"NAME" if DB_ENGINE.endswith("sqlite3") else "HOST": shard},
+    )
+# Side of the square cells businesses are sharded by, in degrees
+BUSINESS_SHARD_CELL_DEGREES = config('BUSINESS_SHARD_CELL_DEGREES', default=1.0, cast=float)
+# Seconds a process keeps the cell to shard assignments before reloading them
+BUSINESS_SHARD_MAP_TTL = config('BUSINESS_SHARD_MAP_TTL', default=30, cast=int)
+# Threads querying shards in parallel, per process
+BUSINESS_SHARD_WORKERS = config('BUSINESS_SHARD_WORKERS', default=8, cast=int)
+
+DATABASE_ROUTERS = ["businesses.sharding.BusinessShardRouter", "mbapp.db.ReadWriteRouter"]
+
+# Shared cache on Redis when REDIS_URL is set, otherwise a per-process in-memory cache
+REDIS_URL = config('REDIS_URL', default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
     }
+
+# Applied by mbapp.db.apply_sqlite_pragmas on every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 268435456,
+    "cache_size": -65536,
+    "temp_store": "MEMORY",
 }
 
 
@@ -142,7 +270,7 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.TracedJWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -154,9 +282,15 @@ SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True
     # OTHER SETTINGS
 }
+# Rows fetched from the database cursor and encoded per chunk by mbapp.streaming.StreamingJSONResponse
+STREAMING_CHUNK_SIZE = config('STREAMING_CHUNK_SIZE', default=2000, cast=int)
+# Precompiled OpenAPI documents, see mbapp.schema
+SCHEMA_CACHE_DIR = config('SCHEMA_CACHE_DIR', default=os.path.join(BASE_DIR, ".schema_cache/"))
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'user.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'user.serializers.TokenRefreshSerializer',
 }
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
@@ -0,0 +1,19 @@
+"""
+Settings for running the test suite, used by `manage.py test` by default.
+
+Not named test*.py, which test discovery would import.
+"""
+from mbapp.settings import *  # noqa: F401,F403
+
+# Tests write buffered user activity with ActivityTracker.flush() themselves rather than
+# racing a background thread for the test database.
+ACTIVITY_FLUSH_INTERVAL = 0
+
+# Two business shards unless DB_SHARDS configures some, so the sharded code paths are tested by
+# default; run with --settings mbapp.settings to test without sharding. Their test databases are
+# created next to the default one, in memory for SQLite.
+if not any(alias.startswith("shard_") for alias in DATABASES):
+    DATABASES = dict(DATABASES, **{
+        "shard_%d" % index: dict(DATABASES["default"], NAME="%s_shard_%d" % (DATABASES["default"]["NAME"], index))
+        for index in range(2)
+    })
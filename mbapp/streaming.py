@@ -0,0 +1,173 @@
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+GZIP_LEVEL = 6
+# Brotli's higher qualities cost far more CPU than they save on the wire for a live stream.
+BROTLI_QUALITY = 5
+
+_encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+        Renders a list as newline delimited JSON, one element per line.
+
+        Lets views offer NDJSON through DRF content negotiation, either with an
+        `Accept: application/x-ndjson` header or `?format=ndjson`. Views stream
+        their NDJSON bodies with StreamingJSONResponse; the renderer is used for
+        the regular responses of such a view, e.g. errors.
+    """
+    media_type = NDJSON_CONTENT_TYPE
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not isinstance(data, list):
+            data = [data]
+        return b''.join(encode_ndjson(data, len(data) or 1))
+
+
+def encode_ndjson(rows, chunk_size):
+    """
+        Encodes rows as newline delimited JSON, chunk_size rows per yielded chunk.
+
+        Args:
+            rows (iterable): JSON serializable rows, usually a queryset iterator.
+            chunk_size (int): Number of rows encoded into each chunk.
+
+        Returns:
+            generator: The encoded chunks as bytes.
+    """
+    lines = []
+    for row in rows:
+        lines.append(_encoder.encode(row))
+        if len(lines) >= chunk_size:
+            lines.append('')
+            yield '\n'.join(lines).encode('utf-8')
+            lines = []
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
+
+
+class _GzipCompressor:
+    def __init__(self):
+        # wbits=31 writes the gzip header and trailer around the deflate stream.
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        # A sync flush ends every chunk on a byte boundary, so the client can
+        # decode it as soon as it arrives instead of waiting for the next one.
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def available_encodings():
+    """
+        Returns the supported content codings, most preferred first.
+    """
+    if brotli is not None:
+        return ('br', 'gzip')
+    return ('gzip',)
+
+
+def negotiate_encoding(accept_encoding, encodings=None):
+    """
+        Picks the content coding for a response from an Accept-Encoding header.
+
+        Args:
+            accept_encoding (str): The Accept-Encoding request header.
+            encodings (tuple): The codings the response is available in, most
+                preferred first; available_encodings() by default.
+
+        Returns:
+            str: One of the codings, or None to send the response uncompressed.
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+
+    best, best_quality = None, 0.0
+    for coding in encodings or available_encodings():
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def _compress(chunks, compressor):
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+        Streams rows to the client as NDJSON, compressed on the fly.
+
+        Rows are pulled from the iterable, encoded and compressed one chunk at a
+        time while the response is being sent, so memory use does not grow with
+        the number of rows. Pass a queryset's iterator(chunk_size=...) to read
+        the rows through a server-side cursor. The body is gzip or brotli
+        compressed when the client accepts it.
+
+        Args:
+            request (HttpRequest): The request being answered, for content negotiation.
+            rows (iterable): JSON serializable rows.
+            chunk_size (int): Rows per encoded chunk, settings.STREAMING_CHUNK_SIZE by default.
+    """
+
+    def __init__(self, request, rows, chunk_size=None, **kwargs):
+        chunk_size = chunk_size or settings.STREAMING_CHUNK_SIZE
+        chunks = encode_ndjson(rows, chunk_size)
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding == 'br':
+            chunks = _compress(chunks, _BrotliCompressor())
+        elif encoding == 'gzip':
+            chunks = _compress(chunks, _GzipCompressor())
+        kwargs.setdefault('content_type', NDJSON_CONTENT_TYPE)
+        super().__init__(chunks, **kwargs)
+        if encoding is not None:
+            self['Content-Encoding'] = encoding
+        patch_vary_headers(self, ('Accept-Encoding',))
+        # Tells nginx to pass the stream through as it is produced rather than buffer it.
+        self['X-Accel-Buffering'] = 'no'
@@ -0,0 +1,164 @@
+import copy
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+
+from mbapp.db import PRIMARY_DB, ReadWriteRouter, reset_primary_pinning
+from mbapp.metrics import Registry
+from mbapp.middleware import check_session_middleware, check_session_security
+from mbapp.schema import compile_schema
+
+
+@override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8'], METRICS_TOKEN='scrape-token')
+class MetricsAccessTest(SimpleTestCase):
+
+    def test_metrics_only_served_to_allowed_clients(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5',
+                                         HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE http_request_duration_seconds histogram', response.content)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5',
+                                         HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RouteMiddlewareDispatcherTest(TestCase):
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+
+    def test_api_paths_skip_session_middleware(self):
+        response = self.client.post('/user/api/signin/', {'email': 'nobody@example.com', 'password': 'password'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        for attribute in ('session', '_messages'):
+            self.assertFalse(hasattr(response.wsgi_request, attribute), attribute)
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertNotIn('csrftoken', response.cookies)
+
+    def test_admin_runs_session_middleware(self):
+        response = self.client.get('/admin/login/')
+        self.assertEqual(response.status_code, 200)
+        request = response.wsgi_request
+        self.assertTrue(hasattr(request, 'session'))
+        self.assertFalse(request.user.is_authenticated)
+        self.assertTrue(hasattr(request, '_messages'))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertIn('csrftoken', response.cookies)
+        self.assertEqual(self.client.post('/admin/login/', {'username': 'admin', 'password': 'x'}).status_code, 403)
+
+    def test_check_reports_missing_admin_middleware(self):
+        self.assertEqual(check_session_middleware(None), [])
+        with override_settings(SESSION_MIDDLEWARE=['django.contrib.sessions.middleware.SessionMiddleware']):
+            self.assertEqual([error.id for error in check_session_middleware(None)], ['mbapp.E001', 'mbapp.E002'])
+        with override_settings(API_PATH_PREFIXES=('/admin/',)):
+            self.assertEqual([error.id for error in check_session_middleware(None)], ['mbapp.E004'])
+
+    def test_deploy_check_covers_session_security_middleware(self):
+        with override_settings(CSRF_COOKIE_SECURE=True, X_FRAME_OPTIONS='DENY'):
+            self.assertEqual(check_session_security(None), [])
+        with override_settings(CSRF_COOKIE_SECURE=False, X_FRAME_OPTIONS='SAMEORIGIN'):
+            self.assertEqual([warning.id for warning in check_session_security(None)], ['mbapp.W016', 'mbapp.W019'])
+        with override_settings(SESSION_MIDDLEWARE=['django.contrib.sessions.middleware.SessionMiddleware']):
+            self.assertEqual([warning.id for warning in check_session_security(None)], ['mbapp.W003', 'mbapp.W002'])
+
+
+class ReadWriteRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        replica = dict(settings.DATABASES[PRIMARY_DB], TEST={'MIRROR': PRIMARY_DB})
+        settings_override = override_settings(DATABASES=dict(settings.DATABASES, replica_0=replica))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_primary_pinning()
+        self.addCleanup(reset_primary_pinning)
+        self.router = ReadWriteRouter()
+
+    def test_writes_pin_reads_to_primary_until_next_request(self):
+        from user.models import User
+
+        self.assertEqual(self.router.db_for_read(User), 'replica_0')
+        self.assertEqual(self.router.db_for_write(User), PRIMARY_DB)
+        self.assertEqual(self.router.db_for_read(User), PRIMARY_DB)
+        request_started.send(sender=self.__class__)
+        self.assertEqual(self.router.db_for_read(User), 'replica_0')
+
+    def test_only_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate(PRIMARY_DB, 'user'))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'user'))
+
+
+class MetricsSnapshotTest(SimpleTestCase):
+
+    def test_every_process_writes_its_own_snapshot(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests.')
+        getpid = mock.patch('mbapp.metrics.os.getpid', return_value=100)
+        with override_settings(METRICS_MULTIPROCESS_DIR=str(directory)), getpid as pid, \
+                mock.patch('mbapp.metrics.time.time', side_effect=[1.0, 2.0, 3.0]):
+            # The master wrote a snapshot before forking any worker.
+            registry.flush()
+            registry.discard()
+            registry.flush()
+            self.assertEqual(list(directory.glob('*.json')), [])
+            requests.inc()
+            first_worker, second_worker = copy.copy(registry), copy.copy(registry)
+            pid.return_value = 200
+            first_worker.flush()
+            # A later worker reusing the pid of an exited one does not overwrite its snapshot.
+            second_worker.flush()
+            self.assertEqual(sorted(path.name for path in directory.glob('*.json')), ['200-2000.json', '200-3000.json'])
+            self.assertEqual(second_worker.collect()['requests_total'], {'[]': 2})
+
+DOCUMENTS = {'yaml': b'openapi: 3.0.3\n', 'json': b'{"openapi": "3.0.3"}'}
+
+
+class SchemaCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(SCHEMA_CACHE_DIR=str(self.cache_dir))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        generate_documents = mock.patch('mbapp.schema.generate_documents', return_value=DOCUMENTS)
+        self.generate_documents = generate_documents.start()
+        self.addCleanup(generate_documents.stop)
+
+    def test_compile_replaces_only_other_versions(self):
+        stale = self.cache_dir / 'openapi-0123456789abcdef.json'
+        stale.write_bytes(b'{}')
+        # Possibly still being written by a process running the other version.
+        in_progress = self.cache_dir / 'openapi-0123456789abcdef.yaml.x1y2.tmp'
+        in_progress.write_bytes(b'')
+        schema = compile_schema()
+        self.assertFalse(stale.exists())
+        self.assertTrue(in_progress.exists())
+        self.assertEqual(compile_schema().documents, schema.documents)
+        self.assertEqual(self.generate_documents.call_count, 1)
+
+    @mock.patch('mbapp.schema._compiled', None)
+    def test_gzip_follows_accept_encoding_quality(self):
+        response = self.client.get('/api/schema/', {'format': 'json'}, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get('/api/schema/', {'format': 'json'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_if_none_match_lists_weak_validators_and_wildcard(self):
+        etag = self.client.get('/api/schema/', {'format': 'json'})['ETag']
+        for if_none_match in (etag, '"other", %s' % etag, 'W/%s' % etag, '*'):
+            response = self.client.get('/api/schema/', {'format': 'json'}, HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/api/schema/', {'format': 'json'}, HTTP_IF_NONE_MATCH='"other", W/"stale"')
+        self.assertEqual(response.status_code, 200)
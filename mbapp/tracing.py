@@ -0,0 +1,179 @@
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from mbapp.middleware import ObservedStream
+
+logger = logging.getLogger(__name__)
+
+_current_trace = ContextVar('mbapp_trace', default=None)
+
+
+class Trace:
+    """
+        Collects the phase timings of a single request.
+
+        Spans with the same name are aggregated, so a phase entered several times
+        during a request is reported once with its total duration and count.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.annotations = {}
+
+    def record(self, name, duration_ms):
+        phase = self.phases.get(name)
+        if phase is None:
+            self.phases[name] = [duration_ms, 1]
+        else:
+            phase[0] += duration_ms
+            phase[1] += 1
+
+    def annotate(self, name, value):
+        """
+            Attaches a value without a duration, reported as a Server-Timing description.
+        """
+        self.annotations[name] = value
+
+    @property
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms):
+        """
+            Formats the collected phases as a Server-Timing header value.
+        """
+        entries = ['%s;dur=%.2f' % (name, duration) for name, (duration, count) in self.phases.items()]
+        entries.extend('%s;desc="%s"' % (name, value) for name, value in self.annotations.items())
+        entries.append('total;dur=%.2f' % total_ms)
+        return ', '.join(entries)
+
+
+class _Span:
+    __slots__ = ('name', 'trace', 'started')
+
+    def __init__(self, name, trace):
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.trace.record(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def current_trace():
+    """
+        Returns the Trace of the request being handled, or None if tracing is off.
+    """
+    return _current_trace.get()
+
+
+def span(name):
+    """
+        Times a block of code as the phase `name` of the current request.
+
+        Usage:
+            with span('geocode'):
+                ...
+
+        Outside a traced request this returns a shared no-op context manager, so
+        instrumented code costs a single context variable lookup when disabled.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(name, trace)
+
+
+def traced(name):
+    """
+        Decorator form of span(), timing every call of the wrapped function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with _Span(name, trace):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _active(trace):
+    token = _current_trace.set(trace)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+class TracingMiddleware:
+    """
+        Starts a Trace for every request when settings.TRACING_ENABLED is set.
+
+        The collected phases are returned in a Server-Timing response header and
+        logged as one structured record per request on the mbapp.tracing logger.
+        A streamed response's header is sent before its body and only times the
+        view; its log record is written once the body has been sent and covers
+        the whole stream. When tracing is disabled the middleware removes itself
+        from the stack.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRACING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trace = Trace()
+        with _active(trace):
+            response = self.get_response(request)
+        total_ms = trace.total_ms
+        response['Server-Timing'] = trace.server_timing(total_ms)
+        if response.streaming:
+            ObservedStream.wrap(response, lambda: _active(trace), lambda: self.log(request, response, trace))
+        else:
+            self.log(request, response, trace, total_ms)
+        return response
+
+    def log(self, request, response, trace, total_ms=None):
+        if total_ms is None:
+            total_ms = trace.total_ms
+        logger.info(
+            "%s %s %s %.2fms", request.method, request.path, response.status_code, total_ms,
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(total_ms, 2),
+                'phases': {name: {'duration_ms': round(duration, 2), 'count': count}
+                           for name, (duration, count) in trace.phases.items()},
+                'annotations': trace.annotations,
+            },
+        )
@@ -1,14 +1,18 @@
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
+
+from mbapp.metrics import metrics_view
+from mbapp.schema import CachedSpectacularAPIView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include('user.urls')),
     path("", include('businesses.urls')),
     # YOUR PATTERNS
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('api/schema/', CachedSpectacularAPIView.as_view(), name='schema'),
     # Optional UI:
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    path('metrics', metrics_view, name='metrics'),
 ]
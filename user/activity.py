@@ -0,0 +1,179 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from mbapp.db import PRIMARY_DB
+from mbapp.metrics import USER_ACTIVITY_FLUSHED
+
+logger = logging.getLogger(__name__)
+
+# Buffered timestamps per user id: (last_login, last_seen).
+LAST_LOGIN, LAST_SEEN = 0, 1
+FIELDS = (('last_login', LAST_LOGIN), ('last_seen', LAST_SEEN))
+
+
+def _latest(*times):
+    return max((when for when in times if when is not None), default=None)
+
+
+class ActivityTracker:
+    """
+        Buffers user sign-ins and requests in memory and writes them in batches.
+
+        Recording activity only updates a per-process dictionary, so sign-ins,
+        token refreshes and authenticated requests never write to the user
+        table themselves. A background thread writes the buffered timestamps
+        every settings.ACTIVITY_FLUSH_INTERVAL seconds, with one UPDATE per
+        settings.ACTIVITY_FLUSH_BATCH_SIZE users, so the stored timestamps lag
+        by at most that interval. Gunicorn workers also flush it when they
+        exit, see worker_exit in gunicorn.conf.py, and any other process, e.g.
+        runserver or a management command, flushes it at interpreter exit.
+        A timestamp is never replaced by an older one, so workers flushing in
+        any order leave the latest activity in the database.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self._database = None
+
+    def record_login(self, user_id, when=None):
+        """
+            Records a sign-in, which also counts as activity.
+        """
+        self._record(user_id, when or timezone.now(), login=True)
+
+    def record_seen(self, user_id, when=None):
+        """
+            Records an authenticated request or token refresh.
+        """
+        self._record(user_id, when or timezone.now(), login=False)
+
+    def _record(self, user_id, when, login):
+        with self._lock:
+            last_login, last_seen = self._pending.get(user_id, (None, None))
+            if login:
+                last_login = _latest(last_login, when)
+            self._pending[user_id] = (last_login, _latest(last_seen, when))
+        self._start_flusher()
+
+    def last_active(self, user):
+        """
+            Returns when a user was last active, None if never.
+
+            Combines the user's stored timestamps with the activity of this
+            process that is not written yet, without querying the database.
+
+            Args:
+                user (User): The user, as already loaded for the request.
+
+            Returns:
+                datetime: The latest sign-in or request of the user.
+        """
+        with self._lock:
+            pending = self._pending.get(user.pk, ()) + self._flushing.get(user.pk, ())
+        return _latest(user.last_login, user.last_seen, *pending)
+
+    def flush(self):
+        """
+            Writes the buffered timestamps to the database.
+
+            Timestamps that could not be written stay buffered for the next flush.
+
+            Returns:
+                int: Number of users whose activity was written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            if not self._flushing:
+                return 0
+            batch_size = getattr(settings, 'ACTIVITY_FLUSH_BATCH_SIZE', 500)
+            rows = list(self._flushing.items())
+            try:
+                for start in range(0, len(rows), batch_size):
+                    self._write(rows[start:start + batch_size])
+            except Exception:
+                with self._lock:
+                    for user_id, (last_login, last_seen) in self._flushing.items():
+                        pending_login, pending_seen = self._pending.get(user_id, (None, None))
+                        self._pending[user_id] = (_latest(last_login, pending_login), _latest(last_seen, pending_seen))
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            USER_ACTIVITY_FLUSHED.inc(len(rows))
+            return len(rows)
+
+    def _write(self, rows):
+        from user.models import User
+
+        updates = {}
+        for field, index in FIELDS:
+            whens = [
+                When(Q(pk=user_id) & (Q(**{field + '__isnull': True}) | Q(**{field + '__lt': times[index]})),
+                     then=Value(times[index]))
+                for user_id, times in rows if times[index] is not None
+            ]
+            if whens:
+                updates[field] = Case(*whens, default=F(field), output_field=User._meta.get_field(field))
+        User.objects.filter(pk__in=[user_id for user_id, _ in rows]).update(**updates)
+
+    def _start_flusher(self):
+        # Started on first use in every process, so workers forked from a
+        # preloaded master each run their own flusher.
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+            self._database = connections[PRIMARY_DB].settings_dict['NAME']
+        if getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 10.0) > 0:
+            threading.Thread(target=self._run_flusher, name='activity-flusher', daemon=True).start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 10.0))
+            try:
+                self.flush()
+            except Exception:
+                logger.warning('Could not write user activity, retrying in the next flush.', exc_info=True)
+            finally:
+                connections.close_all()
+
+    def flush_at_exit(self):
+        """
+            Flushes what is still buffered when the interpreter exits.
+
+            Activity buffered against another database, e.g. a test database
+            that is already destroyed, is dropped. Errors are logged, not raised.
+        """
+        try:
+            if self._database == connections[PRIMARY_DB].settings_dict['NAME']:
+                self.flush()
+        except Exception:
+            logger.warning('Could not write user activity at exit.', exc_info=True)
+
+
+tracker = ActivityTracker()
+atexit.register(tracker.flush_at_exit)
+
+
+def record_login(sender, user, **kwargs):
+    """
+        user_logged_in receiver buffering session sign-ins, e.g. to the admin,
+        in place of django.contrib.auth.models.update_last_login.
+    """
+    tracker.record_login(user.pk)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class UserConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "user"
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+
+        from user.activity import record_login
+        # Session sign-ins are buffered like token ones instead of saving the user right away.
+        user_logged_in.disconnect(dispatch_uid="update_last_login")
+        user_logged_in.connect(record_login, dispatch_uid="update_last_login")
@@ -0,0 +1,24 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from mbapp.tracing import span
+from user.activity import tracker
+
+
+class TracedJWTAuthentication(JWTAuthentication):
+    """
+        JWTAuthentication reporting token validation and the user lookup as the
+        'auth' phase of the request trace, and recording the user as active.
+    """
+
+    def authenticate(self, request):
+        with span('auth'):
+            result = super().authenticate(request)
+        if result is not None:
+            tracker.record_seen(result[0].pk)
+        return result
+
+
+class TracedJWTScheme(SimpleJWTScheme):
+    # Documents TracedJWTAuthentication as the same bearer scheme as JWTAuthentication.
+    target_class = 'user.authentication.TracedJWTAuthentication'
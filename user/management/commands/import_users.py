@@ -0,0 +1,175 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from user.models import User
+
+USER_FIELDS = ('fullname', 'is_active', 'is_staff')
+
+
+def _init_worker():
+    # Workers started with the "spawn" method do not inherit the app registry.
+    django.setup()
+
+
+def _hash_password(raw_password):
+    return make_password(raw_password)
+
+
+def _read_rows(path, fmt):
+    """
+        Streams user rows from a CSV or JSONL file without loading it into memory.
+
+        Args:
+            path (str): Path of the file to read.
+            fmt (str): Either 'csv' or 'jsonl'.
+
+        Returns:
+            generator: Yields one dict per user row.
+    """
+    with open(path, newline='', encoding='utf-8') as handle:
+        if fmt == 'csv':
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def _is_password_hash(value):
+    try:
+        identify_hasher(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _to_bool(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import users from a CSV or JSONL file. Passwords are hashed across a "
+        "process pool and users are inserted with bulk_create in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file with email, password and optional fullname columns.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Input format, guessed from the extension by default.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Users inserted per bulk_create call.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Processes used for password hashing, 0 hashes in the current process.")
+        parser.add_argument('--prehashed', action='store_true',
+                            help="The password column already holds encoded Django password hashes.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError('File "%s" does not exist.' % path)
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+
+        pool = None
+        if not options['prehashed'] and options['workers'] > 0:
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker)
+
+        stats = {'created': 0, 'duplicates': 0, 'invalid': 0}
+        seen = set()
+        rows = _read_rows(path, fmt)
+        started = time.perf_counter()
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                self._import_batch(batch, seen, pool, options['prehashed'], stats)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+
+        rate = stats['created'] / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            'Created %(created)d users, skipped %(duplicates)d duplicates and %(invalid)d invalid rows' % stats
+            + ' in %.2fs (%.1f users/sec).' % (elapsed, rate)
+        ))
+
+    def _import_batch(self, batch, seen, pool, prehashed, stats):
+        """
+            De-duplicates, hashes and inserts one batch of rows.
+
+            Rows without a password or a valid email address, as checked on
+            signup by UserSerializer, are skipped as invalid, as are rows whose
+            password is not a hash of a configured hasher with --prehashed.
+
+            Duplicates are detected with a single email__in query per batch plus an
+            in-memory set of emails already taken from the file, so no insert is
+            ever attempted for an existing email.
+        """
+        candidates = {}
+        for row in batch:
+            email = (row.get('email') or '').strip()
+            password = row.get('password')
+            if not email or not password:
+                stats['invalid'] += 1
+                continue
+            try:
+                validate_email(email)
+            except ValidationError:
+                stats['invalid'] += 1
+                continue
+            if prehashed and not _is_password_hash(password):
+                stats['invalid'] += 1
+                continue
+            email = User.objects.normalize_email(email)
+            if email in seen or email in candidates:
+                stats['duplicates'] += 1
+                continue
+            candidates[email] = row
+
+        existing = set(User.objects.filter(email__in=list(candidates)).values_list('email', flat=True))
+        for email in existing:
+            del candidates[email]
+        stats['duplicates'] += len(existing)
+        seen.update(candidates)
+        if not candidates:
+            return
+
+        passwords = [row['password'] for row in candidates.values()]
+        if prehashed:
+            hashes = passwords
+        elif pool is not None:
+            hashes = list(pool.map(_hash_password, passwords, chunksize=max(1, len(passwords) // 64)))
+        else:
+            hashes = [_hash_password(password) for password in passwords]
+
+        users = []
+        for (email, row), password_hash in zip(candidates.items(), hashes):
+            extra = {field: row[field] for field in USER_FIELDS if field in row}
+            if 'is_active' in extra:
+                extra['is_active'] = _to_bool(extra['is_active'], True)
+            if 'is_staff' in extra:
+                extra['is_staff'] = _to_bool(extra['is_staff'], False)
+            users.append(User(email=email, password=password_hash, **extra))
+
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=len(users))
+        stats['created'] += len(users)
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-19 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="last_seen",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="last seen"),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="last_login",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="last login"
+            ),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser, PermissionsMixin
 from django.utils import timezone
 from django.utils.translation import gettext as _
+from .activity import tracker
 from .manager import CustomUserManager
 
 
@@ -11,7 +12,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     """
     # required fields
     email = models.EmailField(_('email address'), unique=True)
-    last_login = models.DateTimeField(verbose_name='last login', auto_now=True)
+    # Written in batches by user.activity rather than on every save.
+    last_login = models.DateTimeField(verbose_name='last login', null=True, blank=True)
+    last_seen = models.DateTimeField(verbose_name='last seen', null=True, blank=True)
     is_admin = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -29,6 +32,14 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    @property
+    def last_active(self):
+        """
+            Last sign-in or authenticated request of the user, including activity
+            not yet written to the database. Never queries the database.
+        """
+        return tracker.last_active(self)
+
     class Meta:
         db_table = 'auth_user'
         verbose_name_plural = 'Users'
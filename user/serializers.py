@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from user.activity import tracker
 from user.models import User
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError as DjangoValidationError
@@ -7,10 +10,11 @@ from django.contrib.auth.password_validation import validate_password
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
+    last_active = serializers.DateTimeField(read_only=True)
 
     class Meta:
         model = User
-        fields = ["id", "fullname", "email", "is_active", "password"]
+        fields = ["id", "fullname", "email", "is_active", "password", "last_active"]
 
     def validate_email(self, value):
         """
@@ -46,3 +50,27 @@ class UserSerializer(serializers.ModelSerializer):
         """
         user = User.objects.create_user(**validated_data)
         return user
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    """
+    Token pair serializer recording the sign-in with user.activity instead of saving the user.
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        tracker.record_login(self.user.pk)
+        return data
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    Token refresh serializer recording the refresh as activity of the token's user.
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # The new access token, as the refresh token may already be blacklisted by rotation.
+        access = self.token_class.access_token_class(data["access"])
+        tracker.record_seen(access[jwt_settings.USER_ID_CLAIM])
+        return data
@@ -0,0 +1,163 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from mbapp.querybudget import assert_query_budget
+from user.activity import ActivityTracker
+from user.models import User
+from user.utils import get_tokens_for_user
+
+
+class UserQueryBudgetTest(TestCase):
+
+    def test_user_details_reuses_authenticated_user(self):
+        user = User.objects.create_user('details@example.com', 'password', fullname='Details')
+        authorization = 'Bearer ' + get_tokens_for_user(user)['access']
+        with assert_query_budget(max_queries=1, max_rows=1):
+            response = self.client.get('/user/api/details/', HTTP_AUTHORIZATION=authorization)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user_details']['email'], 'details@example.com')
+
+
+@override_settings(RATELIMIT_ENABLED=True, RATELIMIT_RATES={'auth': '2/m'})
+class SignInRateLimitTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def sign_in(self, **extra):
+        return self.client.post('/user/api/signin/', {'email': 'limit@example.com', 'password': 'password'},
+                                content_type='application/json', **extra)
+
+    def test_throttled_before_password_check(self):
+        User.objects.create_user('limit@example.com', 'password')
+        self.assertEqual([self.sign_in().status_code for _ in range(2)], [200, 200])
+        with mock.patch('user.views.check_password') as check_password, assert_query_budget(max_queries=0):
+            response = self.sign_in()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        check_password.assert_not_called()
+        self.assertEqual(self.sign_in(REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @override_settings(RATELIMIT_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR', RATELIMIT_TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_client_address_header_only_trusted_from_proxies(self):
+        User.objects.create_user('limit@example.com', 'password')
+        spoofed = [self.sign_in(REMOTE_ADDR='203.0.113.5', HTTP_X_FORWARDED_FOR='198.51.100.%d' % i).status_code
+                   for i in range(3)]
+        self.assertEqual(spoofed, [200, 200, 429])
+        # Through the proxy, the right-most address that is not a proxy is the client.
+        forwarded = [self.sign_in(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='198.51.100.%d, 203.0.113.6' % i)
+                     .status_code for i in range(3)]
+        self.assertEqual(forwarded, [200, 200, 429])
+        self.assertEqual(self.sign_in(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.7').status_code, 200)
+
+
+class ActivityTrackerTest(TestCase):
+
+    def test_refresh_records_activity_after_rotation(self):
+        user = User.objects.create_user('refresh@example.com', 'password')
+        refresh = get_tokens_for_user(user)['refresh']
+        # With rotation and blacklisting the refresh token no longer verifies once it is refreshed.
+        verify = mock.patch.object(RefreshToken, 'verify', side_effect=[None, TokenError('Token is blacklisted')])
+        with verify, mock.patch('user.serializers.tracker') as tracker:
+            response = self.client.post('/api/token/refresh/', {'refresh': refresh}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        tracker.record_seen.assert_called_once_with(user.pk)
+
+    def test_buffers_activity_and_flushes_in_one_update(self):
+        users = [User.objects.create_user('active%d@example.com' % i, 'password') for i in range(3)]
+        tracker = ActivityTracker()
+        now = timezone.now()
+        with mock.patch.object(tracker, '_start_flusher'), assert_query_budget(max_queries=0):
+            tracker.record_login(users[0].pk, now)
+            tracker.record_seen(users[1].pk, now)
+            tracker.record_seen(users[1].pk, now - timedelta(minutes=1))
+            tracker.record_seen(users[2].pk, now - timedelta(minutes=1))
+            self.assertEqual(tracker.last_active(users[1]), now)
+        User.objects.filter(pk=users[2].pk).update(last_seen=now)
+
+        with assert_query_budget(max_queries=1):
+            self.assertEqual(tracker.flush(), 3)
+        self.assertEqual(tracker.flush(), 0)
+        first, second, third = User.objects.order_by('pk')
+        self.assertEqual((first.last_login, first.last_seen), (now, now))
+        self.assertEqual((second.last_login, second.last_seen), (None, now))
+        # An older buffered timestamp never replaces a newer stored one.
+        self.assertEqual(third.last_seen, now)
+
+    @override_settings(ACTIVITY_FLUSH_INTERVAL=0)
+    def test_flushes_at_exit_only_to_the_database_it_buffered_for(self):
+        user = User.objects.create_user('exit@example.com', 'password')
+        tracker = ActivityTracker()
+        now = timezone.now()
+        with mock.patch('user.activity.threading.Thread') as thread:
+            tracker.record_seen(user.pk, now)
+        thread.assert_not_called()
+        tracker.flush_at_exit()
+        user.refresh_from_db()
+        self.assertEqual(user.last_seen, now)
+
+        tracker.record_seen(user.pk, now + timedelta(minutes=1))
+        tracker._database = 'destroyed-test-database'
+        with assert_query_budget(max_queries=0):
+            tracker.flush_at_exit()
+        user.refresh_from_db()
+        self.assertEqual(user.last_seen, now)
+
+
+class ImportUsersTest(TestCase):
+
+    def write(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_users(self, path, *args):
+        stdout = StringIO()
+        call_command('import_users', path, '--workers', '0', '--batch-size', '2', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_imports_csv_and_skips_duplicates_and_invalid_rows(self):
+        User.objects.create_user('taken@example.com', 'password')
+        path = self.write('.csv', 'email,password,fullname,is_staff\n'
+                                  'new@example.com,secret,New User,yes\n'
+                                  'taken@example.com,secret,,\n'
+                                  'new@EXAMPLE.com,other,,\n'
+                                  'not-an-email,secret,,\n'
+                                  'nopassword@example.com,,,\n'
+                                  'second@example.com,secret,,\n')
+        output = self.import_users(path)
+        self.assertIn('Created 2 users, skipped 2 duplicates and 2 invalid rows', output)
+        user = User.objects.get(email='new@example.com')
+        self.assertEqual((user.fullname, user.is_staff, user.is_active), ('New User', True, True))
+        self.assertTrue(user.check_password('secret'))
+        self.assertFalse(User.objects.filter(email='not-an-email').exists())
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_imports_prehashed_jsonl(self):
+        rows = [
+            {'email': 'hashed@example.com', 'password': make_password('secret'), 'is_active': False},
+            {'email': 'hashed@example.com', 'password': make_password('other')},
+            {'email': 'bad@@example.com', 'password': make_password('secret')},
+            {'email': 'plain@example.com', 'password': 'secret'},
+            {'email': 'unknown@example.com', 'password': 'md5crypt$1$salt$hash'},
+        ]
+        path = self.write('.jsonl', ''.join(json.dumps(row) + '\n\n' for row in rows))
+        output = self.import_users(path, '--prehashed')
+        self.assertIn('Created 1 users, skipped 1 duplicates and 3 invalid rows', output)
+        user = User.objects.get(email='hashed@example.com')
+        self.assertFalse(user.is_active)
+        self.assertTrue(user.check_password('secret'))
@@ -1,4 +1,5 @@
 from django.urls import path
+from mbapp.ratelimit import rate_limit
 from user.views import *
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -7,7 +8,7 @@ from rest_framework_simplejwt.views import (
 
 urlpatterns = [
     path('', index, name="homepage"),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/', rate_limit('auth', key='ip')(TokenObtainPairView.as_view()), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('user/api/signin/', SignInView.as_view(), name='SignIn'),
     path('user/api/signup/', UserSignupView.as_view(), name='user-signup'),
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.tokens import default_token_generator
 from django.core.exceptions import ValidationError
@@ -12,7 +13,10 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from mbapp import settings
+from mbapp.querybudget import query_budget
+from mbapp.ratelimit import rate_limit
+from mbapp.tracing import span
+from user.activity import tracker
 from user.models import User
 from user.serializers import UserSerializer
 from user.utils import get_tokens_for_user
@@ -31,6 +35,8 @@ def index(request):
     return render(request, 'index.html', {})
 
 
+@rate_limit('auth', key='ip')
+@query_budget(max_queries=2)
 class UserSignupView(CreateAPIView):
     """
     A view for handling user signup requests. Uses the UserSerializer to validate and create new users.
@@ -83,6 +89,8 @@ class UserSignupView(CreateAPIView):
         return Response({'user': user}, status=status.HTTP_201_CREATED)
 
 
+@rate_limit('auth', key='ip')
+@query_budget(max_queries=1)
 class SignInView(APIView):
     permission_classes = [AllowAny]
     """
@@ -114,7 +122,9 @@ class SignInView(APIView):
             }
             return Response(response, status=status.HTTP_403_FORBIDDEN)
 
-        if not check_password(password, user.password):
+        with span('password'):
+            password_matches = check_password(password, user.password)
+        if not password_matches:
             response = {
                 'success': False,
                 'status_code': 401,
@@ -122,6 +132,7 @@ class SignInView(APIView):
             }
             return Response(response, status=status.HTTP_401_UNAUTHORIZED)
 
+        tracker.record_login(user.pk)
         # response data pack as return value
         response = {
             'success': True,
@@ -134,6 +145,7 @@ class SignInView(APIView):
 
 
 # Class based view to Get User Details using Token Authentication
+@query_budget(max_queries=1)
 class UserDetailAPI(APIView):
     permission_classes = (AllowAny,)
 
@@ -149,14 +161,15 @@ class UserDetailAPI(APIView):
         Returns:
             Response: A Response object with the serialized user data and a 200 OK status code.
         """
-        user = User.objects.get(id=request.user.id)
-        serializer = UserSerializer(user)
+        serializer = UserSerializer(request.user)
         response = {
             'user_details': serializer.data
         }
         return Response(response, status=status.HTTP_200_OK)
 
 
+@rate_limit('auth', key='user')
+@query_budget(max_queries=2)
 class ChangePasswordView(APIView):
     permission_classes = [IsAuthenticated]
     """
@@ -202,6 +215,8 @@ class ChangePasswordView(APIView):
         return Response(response, status=status.HTTP_200_OK)
 
 
+@rate_limit('password_reset', key='ip')
+@query_budget(max_queries=1)
 class ForgotPasswordView(APIView):
     permission_classes = [AllowAny]
     """